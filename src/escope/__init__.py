@@ -1,3 +1,4 @@
 from .loader import Recording
-from .spikex import rmsnoise, detectspikes
+from .spikex import rmsnoise, detectspikes, SpikeDetector, detect_all
+from .spikex import RunningNoise
 
@@ -24,7 +24,7 @@ from .escopelib.esscopewin import ESScopeWin
 from .escopelib.estriggerbuffer import ESTriggerBuffer
 from .escopelib import serializer
 from .escopelib.ledlabel import LEDLabel
-from .escopelib import esparkwin
+from .escopelib import espgraph
 
 import signal
 signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -76,7 +76,7 @@ def _loaddata(name, esc, cfg, sweepno):
     return dat, sweepno
 
 class MainWin(QMainWindow):
-    def __init__(self, cfg, sparkcfg):
+    def __init__(self, cfg, sparkcfg=None):
         QWidget.__init__(self)
         self.cfg = cfg
         self.sparkcfg = sparkcfg
@@ -168,6 +168,7 @@ class MainWin(QMainWindow):
         dsp.addItem('Dots')
         dsp.addItem('Lines')
         dsp.addItem('True')
+        dsp.addItem('Persistence')
         dsp.setToolTip("Drawing style for data")
         #dsp.setFixedHeight(20)
         dsp.currentIndexChanged.connect(self.click_display)
@@ -179,6 +180,9 @@ class MainWin(QMainWindow):
         self.hsweepno = QLabel(self)
         self.hsweepno.setText("#000")
         self.hsweepno.setToolTip("This is the number of your current sweep")
+        self.hrates = QLabel(self)
+        self.hrates.setToolTip("Firing rates from live spike detection")
+        self.hrates.hide()
         self.sweepno = 0
 
         # Right part of first row
@@ -220,6 +224,8 @@ class MainWin(QMainWindow):
         but2lay.addWidget(ca)
         but2lay.addWidget(dsp)
         but2lay.addStretch(1)
+        but2lay.addWidget(self.hrates)
+        but2lay.addSpacing(10)
         but2lay.addWidget(self.hdate)
         but2lay.addWidget(self.hsweepno)
 
@@ -407,6 +413,7 @@ class MainWin(QMainWindow):
         self.inSweep = False
         self.ds = ESTriggerBuffer(self.cfg)
         self.ds.deviceError.connect(self.deviceerror)
+        self.ds.levelChanged.connect(self.rpane.update)
         if self.h_spark:
             self.ds.reconfig(self.h_spark.cfg)
         else:
@@ -419,6 +426,9 @@ class MainWin(QMainWindow):
         p.setColor(QPalette.WindowText, QColor("black"))
         self.hsweepno.setPalette(p)
         self.apane.startRun(self.ds)
+        if self.ds.spikes is not None:
+            self.ds.spikes.ratesChanged.connect(self.updateRates)
+        self.hrates.setVisible(self.ds.spikes is not None)
         if self.cfg.capt_enable:
             self.writeInfoFile()
             self.ds.startCapture(self.rundate)
@@ -431,6 +441,15 @@ class MainWin(QMainWindow):
             raise AttributeError('Failed to run')
         self.update()
 
+    def updateRates(self):
+        if self.ds is None or self.ds.spikes is None:
+            return
+        bits = []
+        for chan, rate in zip(self.ds.spikes.chans, self.ds.spikes.rates()):
+            col = esconfig.color(self.cfg, chan).name()
+            bits.append(f'<span style="color:{col}">{rate:.1f} Hz</span>')
+        self.hrates.setText(" ".join(bits))
+
     def stopRunSoon(self):
         if self.cfg.hori.s_div>=1 or not self.inSweep:
             self.stopRun()
@@ -630,6 +649,10 @@ class MainWin(QMainWindow):
 
     def click_stim(self):
         if self.h_spark is None:
+            # Loaded on first use to keep startup quick
+            from .escopelib import esparkwin
+            if self.sparkcfg is None:
+                self.sparkcfg = esparkwin.espconfig.basicconfig()
             self.h_spark = esparkwin.MainWin(self.sparkcfg, self.cfg)
             self.h_spark.channelsChanged.connect(self.spark_channel_change)
             self.h_spark.runRequested.connect(self.spark_runrequest)
@@ -659,13 +682,20 @@ def main():
         os.mkdir("EScopeData")
     os.chdir("EScopeData")
     app = QApplication(sys.argv)
+    if "--matplotlib" in sys.argv[1:]:
+        espgraph.setBackend('matplotlib')
     cfg = esconfig.basicconfig()
-    sparkcfg = esparkwin.espconfig.basicconfig()
 
-    mw = MainWin(cfg, sparkcfg)
+    mw = MainWin(cfg)
 
     mw.displaystyle.setCurrentIndex(2)
     mw.displaystyle.hide() # on modern computer hardware, this control is not needed, and it confuses students
+    if "--persistence" in sys.argv[1:]:
+        mw.displaystyle.setCurrentIndex(3)
+    if "--spikes" in sys.argv[1:]:
+        cfg.spikes.enable = True
+    if "--opengl" in sys.argv[1:]:
+        mw.apane.setOpenGL(True)
     mw.show()
     app.exec_()
     
@@ -20,9 +20,8 @@
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 import sys
+import functools
 import numpy as np
-from . import esnidaq
-from . import espicodaq
 import time
 
 from .Struct import Struct
@@ -124,6 +123,17 @@ def niceunitmatching(num, eg, uni):
 
 
 def findadapters():
+    """List of available adapters
+
+    The device libraries are imported and the hardware enumerated on
+    the first call only. EScope and ESpark share the result.
+    """
+    return list(_findadapters())
+
+@functools.lru_cache(maxsize=None)
+def _findadapters():
+    from . import esnidaq
+    from . import espicodaq
     lst=[('dummy',)]
     nidevs = esnidaq.deviceList()
     for dev in nidevs:
@@ -131,7 +141,7 @@ def findadapters():
     picodevs = espicodaq.deviceList()
     for dev in picodevs:
         lst.append(('picodaq', dev))
-    return lst
+    return tuple(lst)
 
 def reasonable(xmin,xmax):
     x0 = np.floor(np.log10(xmin))
@@ -162,9 +172,11 @@ def inputchannels(ada):
         for k in range(8):
             chs.append(f'ai{k}')
     elif typ=='nidaq':
+        from . import esnidaq
         dev = ada[1]
         chs = esnidaq.devAIChannels(dev)
     elif typ=='picodaq':
+        from . import espicodaq
         dev = ada[1]
         chs = espicodaq.devAIChannels(dev)
     else:
@@ -191,6 +203,19 @@ def datetime():
     tim = time.strftime('%H%M%S',t0)
     return (dat,tim)
 
+def cachekey(*args):
+    '''Snapshot of ARGS that can be compared to detect changes
+
+    Arrays and lists are represented by their contents, so that
+    snapshots compare equal even if those contain NaNs.
+    '''
+    key = []
+    for a in args:
+        if isinstance(a, (np.ndarray, list, tuple)):
+            a = np.asarray(a).tobytes()
+        key.append(a)
+    return tuple(key)
+
 _colors = {}
 def color(cfg, k):
     cc = cfg.COLORS[k]
@@ -242,6 +267,13 @@ def basicconfig():
     cfg.trig.level_div = 0
     cfg.trig.direction = 1 # 1=up, -1=down
     cfg.trig.delay_div = 5
+    cfg.trig.noise_mult = 0 # If nonzero, level follows the RMS noise
+
+    cfg.spikes = Struct()
+    cfg.spikes.enable = False # Live spike detection, see ESSpikeStage
+    cfg.spikes.channels = None # Channel #s, or None for all
+    cfg.spikes.noise_mult = 5
+    cfg.spikes.window_s = 1 # For firing rates
 
     cfg.capt_enable = False
     
@@ -52,6 +52,7 @@ if nidaq:
     DAQmx_ContSamps = nidaqmx.constants.AcquisitionType.CONTINUOUS
     DAQmx_HWTimedSinglePoint = nidaqmx.constants.AcquisitionType.HW_TIMED_SINGLE_POINT
     DAQmx_ChanPerLine = nidaqmx.constants.LineGrouping.CHAN_PER_LINE
+    DAQmx_NoRegen = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
     
 
 def deviceList():
@@ -176,15 +177,36 @@ class ContAcqTask:
 
 ######################################################################
 
+class _DenseStim:
+    # Wraps a plain TxC array to look like a StimStream
+    def __init__(self, data):
+        self.data = data
+    def __len__(self):
+        return len(self.data)
+    def block(self, t0, t1):
+        return self.data[t0:t1]
+
 class FiniteProdTask:
+    """Finite output on analog and digital channels
+
+    DATA may be a TxC array or an espconfig.StimStream. Output is
+    written to the device in blocks of at most CHUNK scans, so that
+    long protocols never have to exist in memory as a whole; the
+    device buffer holds two blocks.
+    """
+    CHUNK = 65536
+    
     def __init__(self, dev, chans, genrate_hz, data):
         self.dev = dev
         self.chans = chans # i.e., names of the channels
         self.genrate_hz = genrate_hz
         self.th = None
-        self.data = data # TxC
+        self.ath = None
+        self.dth = None
+        self.foo = None
         self.prepped = False
         self.running = False
+        self.setData(data)
 
     def __del__(self):
         self.stop()
@@ -192,6 +214,8 @@ class FiniteProdTask:
 
     def setData(self, data):
         self.unprep()
+        if isinstance(data, np.ndarray):
+            data = _DenseStim(data)
         self.data = data
 
     def setCallback(self, foo):
@@ -204,75 +228,104 @@ class FiniteProdTask:
         if nidaq is None:
             raise AttributeError('No NIDAQ library found')
         self.ath = nidaqmx.Task()
-        self.adata = []
+        self.aidx = []
         self.dth = nidaqmx.Task()
-        self.ddata = []
+        self.didx = []
         for k, ch in enumerate(self.chans):
             if ch.lower().startswith("a"):
                 self.ath.ao_channels.add_ao_voltage_chan(self.dev + "/" + ch,
                                                          ch,
                                                          min_val=-10, max_val=10,
                                                          units=DAQmx_Volts)
-                self.adata.append(self.data[:,k].copy())
+                self.aidx.append(k)
             else:
                 lines = self.dev + "/" + ch.replace("P", "port").replace(".", "/line")
                 self.dth.do_channels.add_do_chan(lines, line_grouping=DAQmx_ChanPerLine)
-                self.ddata.append((self.data[:,k]>0).astype(np.uint32)*0xffffffff)
-        self.adata = np.array(self.adata)
-        self.ddata = np.array(self.ddata)
-        self.ath.timing.cfg_samp_clk_timing(rate=self.genrate_hz,
+                self.didx.append(k)
+        N = len(self.data)
+        self.chunk = min(N, self.CHUNK)
+        streaming = N > 2*self.chunk
+        if len(self.aidx):
+            self.ath.timing.cfg_samp_clk_timing(rate=self.genrate_hz,
                                                 active_edge=DAQmx_Rising,
                                                 sample_mode=DAQmx_FiniteSamps,
-                                                samps_per_chan=self.adata.shape[-1])
-        if len(self.ddata):
+                                                samps_per_chan=N)
+        if len(self.didx):
             src = f"/{self.dev}/ao/SampleClock"
             self.dth.timing.cfg_samp_clk_timing(rate=self.genrate_hz,
                                                 source=src,
                                                 active_edge=DAQmx_Rising,
                                                 sample_mode=DAQmx_FiniteSamps,
-                                                samps_per_chan=self.ddata.shape[-1])
-                    
+                                                samps_per_chan=N)
+        if len(self.aidx):
+            self.mth = self.ath
+        else:
+            self.mth = self.dth
+        if streaming:
+            for th, idx in [(self.ath, self.aidx), (self.dth, self.didx)]:
+                if len(idx):
+                    th.out_stream.regen_mode = DAQmx_NoRegen
+                    th.out_stream.output_buf_size = 2*self.chunk
+            # The digital task runs off the analog sample clock, so
+            # one event suffices to keep both fed
+            self.mth.register_every_n_samples_transferred_from_buffer_event(
+                self.chunk, self.transferred)
         if self.foo is not None:
-            if len(self.adata):
-                self.ath.register_done_event(self.foo)
-            elif len(self.ddata):
-                self.dth.register_done_event(self.foo)
+            self.mth.register_done_event(self.foo)
         self.prepped = True
 
+    def writeblock(self):
+        """Write the next block of output to the device buffers"""
+        t0 = self.nwritten
+        t1 = min(t0 + self.chunk, len(self.data))
+        if t1 <= t0:
+            return
+        blk = self.data.block(t0, t1)
+        if len(self.aidx):
+            self.awrtr.write_many_sample(
+                np.ascontiguousarray(blk[:,self.aidx].T))
+        if len(self.didx):
+            ddata = (blk[:,self.didx]>0).astype(np.uint32)*0xffffffff
+            self.dwrtr.write_many_sample_port_uint32(
+                np.ascontiguousarray(ddata.T)) # this may not be correct
+        self.nwritten = t1
+
+    def transferred(self, *args):
+        # Called by NIDAQmx from its own thread
+        if self.running:
+            self.writeblock()
+        return 0
+
     def run(self):
         if not self.prepped:
             self.prep()
         if self.running:
             return
-        #nwritten = int32()
-        #offset = 0
-        if len(self.adata):
-            awrtr = nidaqmx.stream_writers.AnalogMultiChannelWriter(self.ath.out_stream)
-            nawritten = awrtr.write_many_sample(self.adata)
-        if len(self.ddata):
-            dwrtr = nidaqmx.stream_writers.DigitalMultiChannelWriter(self.dth.out_stream)
-            ndwritten = dwrtr.write_many_sample_port_uint32(self.ddata) # this may not be correct
+        self.nwritten = 0
+        if len(self.aidx):
+            self.awrtr = nidaqmx.stream_writers.AnalogMultiChannelWriter(self.ath.out_stream)
+        if len(self.didx):
+            self.dwrtr = nidaqmx.stream_writers.DigitalMultiChannelWriter(self.dth.out_stream)
+        self.writeblock()
+        self.writeblock()
+        self.running = True
+        if len(self.didx):
             self.dth.start() # this waits for the analog task if both exists
-        if len(self.adata):
+        if len(self.aidx):
             self.ath.start()
-        self.running = True
      
     def stop(self):
         if self.running:
-            if len(self.ddata):
+            self.running = False
+            if len(self.didx):
                 self.dth.stop()
-            if len(self.adata):
+            if len(self.aidx):
                 self.ath.stop()
-            self.running = False
 
     def isRunning(self):
         if not self.running:
             return False
-        if len(self.adata):
-            th = self.ath
-        else:
-            th = self.dth
-        if th.wait_until_done(0.0001):
+        if self.mth.wait_until_done(0.0001):
             # ^ The NIDAQ docs say that I can use float64(0.0) for immediate
             # answer, but that did not work for me. So I wait 0.1 ms instead.
             return True
@@ -26,6 +26,7 @@ VERSION = "4.1.0"
 
 _PULSECOL=3
 _TRAINCOL=2
+_REBUILDDELAY_MS = 100
 
 class MainWin(QWidget):
     channelsChanged = pyqtSignal()
@@ -45,6 +46,7 @@ class MainWin(QWidget):
         self.label = [None] * self.cfg.MAXCHANNELS
         self.traingraph = [None] * self.cfg.MAXCHANNELS
         self.pulsegraph = [None] * self.cfg.MAXCHANNELS
+        self.rebuildtimer = [None] * self.cfg.MAXCHANNELS
         self.htr = [None] * self.cfg.MAXCHANNELS
         self.hpu = [None] * self.cfg.MAXCHANNELS
         self.frames = [None] * self.cfg.MAXCHANNELS
@@ -465,6 +467,18 @@ class MainWin(QWidget):
             self.rebuildGraphs(k)
 
     def rebuildGraphs(self, k):
+        # Rebuild once edits pause, rather than on every single one
+        if self.rebuildtimer[k] is None:
+            self.rebuildtimer[k] = QTimer(self)
+            self.rebuildtimer[k].setSingleShot(True)
+            self.rebuildtimer[k].setInterval(_REBUILDDELAY_MS)
+            self.rebuildtimer[k].timeout.connect(
+                lambda: self.rebuildGraphsNow(k))
+        self.rebuildtimer[k].start()
+
+    def rebuildGraphsNow(self, k):
+        if self.rebuildtimer[k] is not None:
+            self.rebuildtimer[k].stop()
         self.traingraph[k].rebuild()
         self.pulsegraph[k].rebuild()
 
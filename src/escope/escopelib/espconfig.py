@@ -21,13 +21,19 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 import sys
+import functools
 import numpy as np
-from . import esnidaq
-from . import espicodaq
+from . import esconfig
 import time
 
 from .Struct import Struct
 
+try:
+    from numba import jit
+    havejit = True
+except ModuleNotFoundError:
+    havejit = False
+
 _MAXCHANNELS = 4
 
 class Monovalue:
@@ -203,14 +209,8 @@ def unniceunit(s, uni):
        
 
 def findadapters():
-    lst=[('dummy',)]
-    nidevs = esnidaq.deviceList()
-    for dev in nidevs:
-        lst.append(('nidaq',dev))
-    picodevs = espicodaq.deviceList()
-    for dev in picodevs:
-        lst.append(('picodaq', dev))
-    return lst
+    # Shared with EScope, so that hardware is enumerated only once
+    return esconfig.findadapters()
 
 def reasonable(xmin,xmax):
     x0 = np.floor(np.log10(xmin))
@@ -244,10 +244,12 @@ def outputchannels(ada):
             chs.append(f'P1.{k}')
             
     elif typ=='nidaq':
+        from . import esnidaq
         dev = ada[1]
         chs = esnidaq.devAOChannels(dev)
         chs += esnidaq.devDOChannels(dev)
     elif typ=='picodaq':
+        from . import espicodaq
         dev = ada[1]
         chs = espicodaq.devAOChannels(dev)
         chs += espicodaq.devDOChannels(dev)
@@ -311,7 +313,75 @@ def basicconfig():
 
     return cfg
 
+def _values(x):
+    if isinstance(x, Trivalue):
+        return (x.base, x.delta, x.delti)
+    elif isinstance(x, Bivalue):
+        return (x.base, x.delta)
+    else:
+        return (x.base,)
+
 def mktiming(cfg, k):
+    """Start and end of each pulse in the train for channel K
+
+    Returns a tuple (N, TSTART, TEND), where N is the total length of
+    the train and TSTART and TEND are (NTRAINS, NPULSES)-arrays of
+    sample indices. Entries beyond the end of a shorter train are zero.
+    Results are cached by parameter values; the arrays are read-only.
+    """
+    train = cfg.train[k]
+    pulse = cfg.pulse[k]
+    typ = pulse.type.value
+    if typ==Pulsetype.SINE:
+        ipi_s = pulse.dur1_s
+    else:
+        ipi_s = train.ipi_s
+    dur2_s = pulse.dur2_s if typ==Pulsetype.BIPHASIC else None
+    return _timing(cfg.hw.genrate.value, typ==Pulsetype.OFF,
+                   train.delay_s.base, train.ntrains.base,
+                   _values(train.period_s), _values(train.npulses),
+                   _values(ipi_s), _values(pulse.dur1_s),
+                   None if dur2_s is None else _values(dur2_s))
+
+@functools.lru_cache(maxsize=64)
+def _timing(fs_hz, off, delay_s, ntrains, period_s, npulses, ipi_s,
+            dur1_s, dur2_s):
+    ntr = ntrains
+    Npu = npulses[0]
+    if npulses[1]>0:
+        Npu += npulses[1] * (ntr-1)
+    ntr = int(ntr)
+    Npu = int(Npu)
+    tstart_s = np.zeros((ntr, Npu))
+    tend_s = np.zeros((ntr, Npu))
+    maxend_s = 0
+    if ntr>0 and Npu>0 and not off:
+        itr = np.arange(ntr)[:,None]
+        ipu = np.arange(Npu)[None,:]
+        # Cumulative sums add the same terms in the same order as
+        # _mktiming_py, so the results are identical, not merely close.
+        trainstart_s = np.cumsum(np.concatenate(
+            ([delay_s], period_s[0] + np.arange(ntr-1)*period_s[1])))
+        step_s = ipi_s[0] + itr*ipi_s[1] + ipu*ipi_s[2]
+        tstart_s = np.cumsum(np.concatenate((trainstart_s[:,None],
+                                             step_s[:,:-1]), 1), 1)
+        tend_s = tstart_s + dur1_s[0] + itr*dur1_s[1] + ipu*dur1_s[2]
+        if dur2_s is not None:
+            tend_s += dur2_s[0] + itr*dur2_s[1] + ipu*dur2_s[2]
+        npu = np.array([int(npulses[0] + k*npulses[1]) for k in range(ntr)])
+        valid = ipu < npu[:,None]
+        tstart_s[~valid] = 0
+        tend_s[~valid] = 0
+        if np.any(valid):
+            maxend_s = max(maxend_s, np.max(tend_s[valid]))
+    tstart = (tstart_s*fs_hz).astype(int)
+    tend = (tend_s*fs_hz).astype(int)
+    tstart.flags.writeable = False
+    tend.flags.writeable = False
+    return (int(maxend_s*fs_hz), tstart, tend)
+
+def _mktiming_py(cfg, k):
+    # Reference implementation, kept for comparison
     fs_hz = cfg.hw.genrate.value
 
     nexttrainstart_s = cfg.train[k].delay_s.base
@@ -354,22 +424,394 @@ def mktiming(cfg, k):
                             itr*cfg.train[k].period_s.delta
     return (int(maxend_s*fs_hz), tstart_s*fs_hz, tend_s*fs_hz)
 
-def filltrain(cfg, k, timing, vvv):
-    tau = 1./cfg.hw.genrate.value
+def _filltrain_py(cfg, k, timing, vvv):
+    # Reference implementation, kept for comparison
     for itr in range(int(cfg.train[k].ntrains.base)):
         for ipu in range(int(cfg.train[k].npulses.base +
                              itr*cfg.train[k].npulses.delta)):
             fillpulse(cfg, k, itr, ipu,
                       vvv[int(timing[1][itr,ipu]):int(timing[2][itr,ipu]+1)])
 
-def mktrain(cfg, k):
+def pulseindices(cfg, k):
+    """Train and pulse numbers of all pulses on channel K, in order"""
+    ntr = int(cfg.train[k].ntrains.base)
+    npu = np.array([int(cfg.train[k].npulses.base +
+                        itr*cfg.train[k].npulses.delta)
+                    for itr in range(ntr)], dtype=int)
+    npu = np.maximum(npu, 0)
+    itr = np.repeat(np.arange(ntr), npu)
+    ipu = np.arange(len(itr)) - np.repeat(np.cumsum(npu) - npu, npu)
+    return itr, ipu
+
+def _trivalue(tv, itr, ipu):
+    return tv.base + itr*tv.delta + ipu*tv.delti
+
+def _segments(starts, lo, hi):
+    """Sample positions covered by segments, and offsets within them
+
+    Segment K covers offsets LO[K] up to HI[K] from STARTS[K].
+    """
+    lens = np.maximum(hi - lo, 0)
+    seg = np.repeat(np.arange(len(starts)), lens)
+    tt = lo[seg] + np.arange(len(seg)) - np.repeat(np.cumsum(lens) - lens, lens)
+    return seg, starts[seg] + tt, tt
+
+def _fillpulses_np(vvv, t0, avail, typ, amp1, amp2, dur1, dur2):
+    skip = np.maximum(-t0, 0)
+    n1 = np.minimum(dur1, avail)
+    seg, pos, tt = _segments(t0, skip, n1)
+    styp = typ[seg]
+    val = amp1[seg]
+    use = styp==Pulsetype.RAMP
+    if np.any(use):
+        s = seg[use]
+        val[use] = amp1[s] + (amp2[s]-amp1[s])*tt[use]/dur1[s]
+    use = styp==Pulsetype.SINE
+    if np.any(use):
+        s = seg[use]
+        val[use] = amp1[s]*np.sin(2*np.pi*(tt[use]-dur2[s])/dur1[s])+amp2[s]
+    val[styp==Pulsetype.TTL] = 5.0
+    starts = t0 + skip
+    ends = t0 + np.maximum(n1, skip)
+    order = 2*seg
+    bi = typ==Pulsetype.BIPHASIC
+    if np.any(bi):
+        skip2 = np.maximum(skip, dur1)
+        n2 = np.where(bi, np.minimum(dur1 + dur2, avail), skip2)
+        seg2, pos2, _ = _segments(t0, skip2, n2)
+        pos = np.concatenate((pos, pos2))
+        val = np.concatenate((val, amp2[seg2]))
+        order = np.concatenate((order, 2*seg2 + 1))
+        starts = np.concatenate((starts, t0 + skip2))
+        ends = np.concatenate((ends, t0 + np.maximum(n2, skip2)))
+
+    _writeinorder(vvv, pos, val, order, starts, ends)
+
+def _writeinorder(vvv, pos, val, order, starts, ends):
+    """Write VAL to VVV at POS as if in ORDER
+
+    STARTS and ENDS delimit the segments that the values come from.
+    """
+    # Check for overlap between pulses at the level of whole segments
+    nonempty = ends > starts
+    starts = starts[nonempty]
+    ends = ends[nonempty]
+    o = np.argsort(starts, kind='stable')
+    if np.any(starts[o][1:] < np.maximum.accumulate(ends[o])[:-1]):
+        # Later pulses win, as they would if written in turn
+        o = np.argsort(order, kind='stable')
+        pos = pos[o][::-1]
+        val = val[o][::-1]
+        _, first = np.unique(pos, return_index=True)
+        pos = pos[first]
+        val = val[first]
+    vvv[pos] = val
+
+if havejit:
+    # Numba cannot see class attributes, but freezes global constants
+    _MONOPHASIC = Pulsetype.MONOPHASIC
+    _BIPHASIC = Pulsetype.BIPHASIC
+    _RAMP = Pulsetype.RAMP
+    _SINE = Pulsetype.SINE
+    
+    @jit(nopython=True)
+    def _fillpulses(vvv, t0, avail, typ, amp1, amp2, dur1, dur2):
+        for k in range(len(t0)):
+            skip = max(-t0[k], 0)
+            n1 = min(dur1[k], avail[k])
+            for tt in range(skip, n1):
+                if typ[k]==_MONOPHASIC or typ[k]==_BIPHASIC:
+                    v = amp1[k]
+                elif typ[k]==_RAMP:
+                    v = amp1[k] + (amp2[k]-amp1[k])*tt/dur1[k]
+                elif typ[k]==_SINE:
+                    v = amp1[k]*np.sin(2*np.pi*(tt-dur2[k])/dur1[k])+amp2[k]
+                else:
+                    v = 5.0
+                vvv[t0[k] + tt] = v
+            if typ[k]==_BIPHASIC:
+                n2 = min(dur1[k] + dur2[k], avail[k])
+                for tt in range(max(dur1[k], skip), n2):
+                    vvv[t0[k] + tt] = amp2[k]
+else:
+    _fillpulses = _fillpulses_np
+
+def _copypulses_np(vvv, t0, avail, flat, offs, lens):
+    skip = np.maximum(-t0, 0)
+    n = np.minimum(lens, avail)
+    seg, pos, tt = _segments(t0, skip, n)
+    _writeinorder(vvv, pos, flat[offs[seg] + tt], seg,
+                  t0 + skip, t0 + np.maximum(n, skip))
+
+if havejit:
+    @jit(nopython=True)
+    def _copypulses(vvv, t0, avail, flat, offs, lens):
+        for k in range(len(t0)):
+            n = min(lens[k], avail[k])
+            for tt in range(max(-t0[k], 0), n):
+                vvv[t0[k] + tt] = flat[offs[k] + tt]
+else:
+    _copypulses = _copypulses_np
+
+_MAXTEMPLATES = 64
+# Longer templates are not cached, which bounds the cache to
+# 4 * _MAXTEMPLATES * _MAXCACHEDLEN samples (32 MB)
+_MAXCACHEDLEN = 16384
+
+def _mktemplate(typ, amp1, amp2, dur1, dur2):
+    # Uncached version of _template
+    n = dur1
+    if typ==Pulsetype.BIPHASIC:
+        n = max(n, dur1 + dur2)
+    vv = np.zeros(max(n, 0))
+    one = lambda x, dt: np.array([x], dtype=dt)
+    _fillpulses(vv, one(0, np.int64), one(len(vv), np.int64),
+                one(typ, np.int8), one(amp1, np.float64),
+                one(amp2, np.float64), one(dur1, np.int64),
+                one(dur2, np.int64))
+    vv.flags.writeable = False
+    return vv
+
+_cachedtemplate = functools.lru_cache(maxsize=4*_MAXTEMPLATES)(_mktemplate)
+
+def _template(typ, amp1, amp2, dur1, dur2):
+    """Samples of a single pulse with the given parameters
+
+    Durations are in samples, so the template does not depend on the
+    sampling rate separately. The result is read-only. Templates up to
+    _MAXCACHEDLEN samples are cached.
+    """
+    if max(dur1, dur1 + dur2) > _MAXCACHEDLEN:
+        return _mktemplate(typ, amp1, amp2, dur1, dur2)
+    return _cachedtemplate(typ, amp1, amp2, dur1, dur2)
+
+PULSE_DTYPE = np.dtype([('onset', np.int64),
+                        ('duration', np.int64),
+                        ('type', np.int8),
+                        ('amp1', np.float64),
+                        ('amp2', np.float64),
+                        ('dur1', np.int64),
+                        ('dur2', np.int64)])
+
+# The fields that determine the shape of a pulse
+_SHAPE_FIELDS = ['type', 'amp1', 'amp2', 'dur1', 'dur2']
+
+def mkevents(cfg, k, timing=None):
+    """Pulses on channel K as a list of events
+
+    Returns a structured array of dtype PULSE_DTYPE with one entry
+    per pulse: the sample index of its onset, the number of samples
+    it may occupy, its pulse type, and its amplitudes and phase
+    durations (in samples) as used by FILLPULSE. Events are in the
+    order that FILLTRAIN writes them, so where pulses overlap, later
+    events win.
+
+    TIMING, if given, must be from MKTIMING.
+    """
+    typ = cfg.pulse[k].type.value
+    if typ==Pulsetype.OFF:
+        return np.zeros(0, dtype=PULSE_DTYPE)
+    if typ not in [Pulsetype.MONOPHASIC, Pulsetype.BIPHASIC, Pulsetype.RAMP,
+                   Pulsetype.SINE, Pulsetype.TTL]:
+        raise ValueError(f'Unknown pulsetype: {typ}')
+    if timing is None:
+        timing = mktiming(cfg, k)
+    itr, ipu = pulseindices(cfg, k)
+    fs_hz = cfg.hw.genrate.value
+    pulse = cfg.pulse[k]
+    ev = np.zeros(len(itr), dtype=PULSE_DTYPE)
+    # As in the slices of _filltrain_py
+    ev['onset'] = timing[1][itr, ipu]
+    ev['duration'] = np.maximum(timing[2][itr, ipu] + 1 - ev['onset'], 0)
+    ev['type'] = typ
+    ev['amp1'] = _trivalue(pulse.amp1_u, itr, ipu)
+    ev['amp2'] = _trivalue(pulse.amp2_u, itr, ipu)
+    ev['dur1'] = (fs_hz * _trivalue(pulse.dur1_s, itr, ipu)).astype(int)
+    ev['dur2'] = (fs_hz * _trivalue(pulse.dur2_s, itr, ipu)).astype(int)
+    return ev
+
+def _reach(ev):
+    """Helper for _inwindow
+
+    Returns the running maximum of event ends if onsets are sorted,
+    else None.
+    """
+    if np.any(np.diff(ev['onset']) < 0):
+        return None
+    return np.maximum.accumulate(ev['onset'] + ev['duration'])
+
+def _inwindow(ev, reach, t0, t1):
+    """Events that may write to samples T0 up to T1
+
+    REACH must be from _REACH(EV). If it is not None, this takes
+    logarithmic rather than linear time.
+    """
+    if reach is None:
+        return ev[(ev['onset'] < t1) & (ev['onset'] + ev['duration'] > t0)]
+    i0 = np.searchsorted(reach, t0, 'right')
+    i1 = np.searchsorted(ev['onset'], t1, 'left')
+    return ev[i0:i1]
+
+def _fillwindow(vvv, offset, ev):
+    # Write events into VVV, which starts at sample OFFSET
+    t0 = ev['onset'] - offset
+    t1 = np.minimum(t0 + ev['duration'], len(vvv))
+    use = (t1 > np.maximum(t0, 0))
+    if not np.all(use):
+        ev = ev[use]
+        t0 = t0[use]
+        t1 = t1[use]
+    if len(ev)==0:
+        return
+    # Where pulses repeat, render each distinct one once and copy it
+    shape = _SHAPE_FIELDS
+    key = np.zeros(len(ev), dtype=[(f, PULSE_DTYPE[f]) for f in shape])
+    for f in shape:
+        key[f] = ev[f]
+    # Comparing raw bytes is much faster than comparing records
+    key = key.view(np.dtype((np.void, key.dtype.itemsize)))
+    _, first, tid = np.unique(key, return_index=True, return_inverse=True)
+    if len(first) < len(ev) and len(first) <= _MAXTEMPLATES:
+        tpl = [_template(*(ev[shape][i].item())) for i in first]
+        lens = np.array([len(t) for t in tpl], dtype=np.int64)
+        offs = np.cumsum(lens) - lens
+        _copypulses(vvv, t0, t1 - t0, np.concatenate(tpl),
+                    offs[tid], lens[tid])
+    else:
+        _fillpulses(vvv, t0, t1 - t0, ev['type'], ev['amp1'], ev['amp2'],
+                    ev['dur1'], ev['dur2'])
+
+def filltrain(cfg, k, timing, vvv, offset=0):
+    """Fill VVV with the pulse train for channel K
+
+    TIMING must be from MKTIMING. This produces the same output as
+    calling FILLPULSE for each pulse in turn, but computes all pulse
+    parameters as arrays up front.
+
+    If OFFSET is given, VVV represents samples OFFSET up to
+    OFFSET + len(VVV) of the train, and pulses are clipped to that
+    window.
+    """
+    _fillwindow(vvv, offset, mkevents(cfg, k, timing))
+
+class StimStream:
+    """Stimulus output for several channels, synthesized on demand
+
+    Rather than filling an array for the entire protocol, a StimStream
+    keeps the list of events from MKEVENTS for each channel, and
+    produces any stretch of output when asked. CHANS are channel
+    numbers into cfg.train and cfg.pulse. Events are taken from CFG
+    at construction, so later changes to CFG do not affect a running
+    stream.
+
+    NSCANS is the end of the last pulse. The stream itself is four
+    scans longer, ending in zeros; len() reports that length.
+    """
+    def __init__(self, cfg, chans, blocksize=65536):
+        self.chans = list(chans)
+        self.blocksize = blocksize
+        self.nscans = 0
+        self.events = []
+        for k in self.chans:
+            timing = mktiming(cfg, k)
+            self.nscans = max(self.nscans, timing[0])
+            self.events.append(mkevents(cfg, k, timing))
+        self.reach = [_reach(ev) for ev in self.events]
+
+    def __len__(self):
+        return self.nscans + 4
+
+    def nchans(self):
+        return len(self.chans)
+
+    def block(self, t0, t1):
+        """Output from scan T0 up to T1, as a (T1-T0, NCHANS)-array"""
+        blk = np.zeros((t1 - t0, len(self.chans)))
+        for c, ev in enumerate(self.events):
+            ev = _inwindow(ev, self.reach[c], t0, t1)
+            if len(ev):
+                _fillwindow(blk[:,c], t0, ev)
+        return blk
+
+    def blocks(self, t0=0):
+        """Successive blocks of output, starting at scan T0"""
+        N = len(self)
+        for t in range(t0, N, self.blocksize):
+            yield self.block(t, min(t + self.blocksize, N))
+
+    def dense(self):
+        """The entire output as a single array"""
+        return self.block(0, len(self))
+
+def _mktrain_dense(cfg, k):
+    # Reference implementation, kept for comparison
     timing = mktiming(cfg, k)
     marg = max(timing[0]//20, 1000)
     ttt = (np.arange(-marg, timing[0]+marg))/cfg.hw.genrate.value
     vvv = np.zeros(ttt.shape)
     filltrain(cfg, k, timing, vvv[marg:])
     return (ttt, vvv)
+
+def mktrain(cfg, k):
+    """Pulse train for channel K, for plotting
+
+    Returns times (in seconds) and values, with a margin before and
+    after. Only the samples in and immediately around pulses are
+    included. The train is zero in between, so straight lines
+    connecting the remaining points draw it exactly as the full
+    set of samples would.
+    """
+    timing = mktiming(cfg, k)
+    marg = max(timing[0]//20, 1000)
+    N = timing[0] + marg # Length of the train proper, including margin
+    ev = mkevents(cfg, k, timing)
+    ev['duration'] = np.clip(N - ev['onset'], 0, ev['duration'])
+
+    # Intervals to keep: each pulse plus one sample on either side,
+    # and the very first and last samples.
+    starts = np.concatenate(([-marg], ev['onset'] - 1, [N - 1]))
+    ends = np.concatenate(([1-marg], ev['onset'] + ev['duration'] + 1, [N]))
+    starts = np.clip(starts, -marg, N - 1)
+    ends = np.clip(ends, starts + 1, N)
+    o = np.argsort(starts, kind='stable')
+    newgroup = starts[o][1:] > np.maximum.accumulate(ends[o])[:-1]
+    group = np.empty(len(o), dtype=int)
+    group[o] = np.concatenate(([0], np.cumsum(newgroup)))
+    gstart = np.full(group[o][-1] + 1, N)
+    np.minimum.at(gstart, group, starts)
+    gend = np.full(len(gstart), -marg)
+    np.maximum.at(gend, group, ends)
+
+    # Pack the intervals together, and shift the pulses to match
+    glen = gend - gstart
+    gpacked = np.cumsum(glen) - glen
+    _, tt, _ = _segments(gstart, np.zeros_like(glen), glen)
+    vvv = np.zeros(len(tt))
+    ev['onset'] -= (gstart - gpacked)[group[1:-1]]
+    _fillwindow(vvv, 0, ev)
+    return (tt / cfg.hw.genrate.value, vvv)
     
+def decimate(tt, vv, n):
+    """Reduce a trace to at most about 2N points for display
+
+    TT must be sorted. The time range is divided into N bins, and each
+    bin is represented by its minimum and maximum, in the order that
+    preserves the direction of any edge within it. Traces of no more
+    than 2N points are returned unchanged.
+    """
+    if len(tt) <= 2*n or tt[-1] <= tt[0]:
+        return (tt, vv)
+    bins = ((tt - tt[0]) * (n / (tt[-1] - tt[0]))).astype(int)
+    bins = np.minimum(bins, n - 1)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    ends = np.concatenate((starts[1:], [len(tt)]))
+    lo = np.minimum.reduceat(vv, starts)
+    hi = np.maximum.reduceat(vv, starts)
+    down = vv[ends - 1] < vv[starts]
+    ttt = np.stack((tt[starts], tt[ends - 1]), 1).ravel()
+    vvv = np.stack((np.where(down, hi, lo), np.where(down, lo, hi)), 1).ravel()
+    return (ttt, vvv)
+
 def fillpulse(cfg, k, itr, ipu, vv):
     fs_hz = cfg.hw.genrate.value
     amp1 = cfg.pulse[k].amp1_u.base + \
@@ -459,3 +901,150 @@ def mkpulse(cfg, k, itr, ipu, margin=True):
     vv = np.zeros(tt.shape)
     fillpulse(cfg, k, itr, ipu, vv[marg:])
     return (tt, vv)
+
+def mkpulses(cfg, k, itr, ipu, margin=True, t0=None):
+    """Several pulses at once, for plotting
+
+    Like MKPULSE, but ITR and IPU are arrays of train and pulse
+    numbers. The pulses are joined into single arrays of times and
+    values, separated by NaNs, so that all can be drawn with one plot
+    call. If T0 is given, it is added to the times of each pulse.
+    """
+    itr = np.asarray(itr, dtype=int)
+    ipu = np.asarray(ipu, dtype=int)
+    itr, ipu = np.broadcast_arrays(itr.ravel(), ipu.ravel())
+    if t0 is None:
+        t0 = np.zeros(len(itr))
+    fs_hz = cfg.hw.genrate.value
+    pulse = cfg.pulse[k]
+    ev = np.zeros(len(itr), dtype=PULSE_DTYPE)
+    ev['type'] = pulse.type.value
+    ev['amp1'] = _trivalue(pulse.amp1_u, itr, ipu)
+    ev['amp2'] = _trivalue(pulse.amp2_u, itr, ipu)
+    ev['dur1'] = (fs_hz * _trivalue(pulse.dur1_s, itr, ipu)).astype(int)
+    ev['dur2'] = (fs_hz * _trivalue(pulse.dur2_s, itr, ipu)).astype(int)
+    dur = np.zeros(len(itr), dtype=int)
+    if pulse.type.have1dur():
+        dur += ev['dur1']
+    if pulse.type.have2durUSE():
+        dur += ev['dur2']
+    if margin:
+        marg = np.maximum(dur//20, 2)
+    else:
+        marg = np.zeros(len(itr), dtype=int)
+
+    # Each pulse gets its margins plus one slot for a NaN
+    lens = np.maximum(dur + 2*marg, 0)
+    starts = np.cumsum(lens + 1) - (lens + 1)
+    seg, pos, tt = _segments(starts, np.zeros_like(lens), lens)
+    N = max(np.sum(lens + 1) - 1, 0)
+    ttt = np.full(N, np.nan)
+    ttt[pos] = (tt - marg[seg]) / fs_hz + t0[seg]
+    vvv = np.full(N, np.nan)
+    vvv[pos] = 0
+    if pulse.type.value != Pulsetype.OFF:
+        ev['onset'] = starts + marg
+        ev['duration'] = lens - marg
+        _fillwindow(vvv, 0, ev)
+    return (ttt, vvv)
+
+
+if __name__ == '__main__':
+    # Compare filltrain against the reference on a variety of trains,
+    # then time both on a long train.
+    app = QApplication(sys.argv)
+    cfg = basicconfig()
+    cfg.hw.genrate.value = 200000
+    rng = np.random.default_rng(1)
+    for n in range(200):
+        k = n % cfg.MAXCHANNELS
+        typ = [Pulsetype.MONOPHASIC, Pulsetype.BIPHASIC, Pulsetype.RAMP,
+               Pulsetype.SINE, Pulsetype.TTL][n % 5]
+        cfg.pulse[k].type = Pulsetype(typ)
+        cfg.train[k].ntrains = Monovalue(rng.integers(1, 5))
+        cfg.train[k].period_s = Bivalue(rng.uniform(0.01, 0.05),
+                                        rng.uniform(0, 0.01))
+        cfg.train[k].npulses = Bivalue(rng.integers(1, 10),
+                                       rng.integers(-1, 3))
+        cfg.train[k].ipi_s = Trivalue(rng.uniform(0.001, 0.004),
+                                      rng.uniform(0, 0.001),
+                                      rng.uniform(0, 0.0005))
+        cfg.train[k].delay_s = Monovalue(rng.uniform(0, 0.01))
+        cfg.pulse[k].amp1_u = Trivalue(*rng.uniform(-2, 2, 3))
+        cfg.pulse[k].amp2_u = Trivalue(*rng.uniform(-2, 2, 3))
+        cfg.pulse[k].dur1_s = Trivalue(rng.uniform(0.0002, 0.002),
+                                       rng.uniform(0, 0.0003),
+                                       rng.uniform(0, 0.0001))
+        cfg.pulse[k].dur2_s = Trivalue(rng.uniform(0.0002, 0.002),
+                                       rng.uniform(0, 0.0003),
+                                       rng.uniform(0, 0.0001))
+        if n % 3 == 0:
+            # Identical pulses, which are copied from templates
+            for tv in [cfg.pulse[k].amp1_u, cfg.pulse[k].amp2_u,
+                       cfg.pulse[k].dur1_s, cfg.pulse[k].dur2_s]:
+                tv.delta = tv.delti = 0
+        timing = mktiming(cfg, k)
+        reftiming = _mktiming_py(cfg, k)
+        assert timing[0]==reftiming[0]
+        assert np.array_equal(timing[1], reftiming[1].astype(int))
+        assert np.array_equal(timing[2], reftiming[2].astype(int))
+        ref = np.zeros(timing[0] + 4)
+        _filltrain_py(cfg, k, timing, ref)
+        res = np.zeros(timing[0] + 4)
+        filltrain(cfg, k, timing, res)
+        assert np.array_equal(ref, res), (n, cfg.pulse[k], cfg.train[k])
+        stream = StimStream(cfg, [k], blocksize=int(rng.integers(1, 5000)))
+        blks = np.concatenate(list(stream.blocks()))
+        assert np.array_equal(blks[:,0], res), (n, stream.blocksize)
+        (tt, vv) = mktrain(cfg, k)
+        (ttref, vvref) = _mktrain_dense(cfg, k)
+        assert tt[0]==ttref[0] and tt[-1]==ttref[-1]
+        assert np.array_equal(np.interp(ttref, tt, vv), vvref), n
+        (tt, vv) = decimate(ttref, vvref, 500)
+        assert len(tt) <= 1000 and np.min(vv)==np.min(vvref) \
+            and np.max(vv)==np.max(vvref)
+        itr, ipu = pulseindices(cfg, k)
+        margin = n % 2 == 0
+        ref = [mkpulse(cfg, k, i, j, margin) for i, j in zip(itr, ipu)]
+        nan = [np.array([np.nan])]
+        tt = np.concatenate(sum([[r[0], nan[0]] for r in ref], [])[:-1])
+        vv = np.concatenate(sum([[r[1], nan[0]] for r in ref], [])[:-1])
+        assert np.array_equal((tt, vv), mkpulses(cfg, k, itr, ipu, margin),
+                              equal_nan=True), n
+    print('mktiming, filltrain, StimStream, mktrain, and mkpulses'
+          ' match their references')
+
+    k = 0
+    cfg.pulse[k].type = Pulsetype(Pulsetype.BIPHASIC)
+    cfg.train[k].ntrains = Monovalue(100)
+    cfg.train[k].period_s = Bivalue(1)
+    cfg.train[k].npulses = Bivalue(100)
+    cfg.train[k].ipi_s = Trivalue(0.01)
+    cfg.train[k].delay_s = Monovalue(0)
+    cfg.pulse[k].amp1_u = Trivalue(1, 0.01, 0.001)
+    cfg.pulse[k].dur1_s = Trivalue(0.0005)
+    cfg.pulse[k].dur2_s = Trivalue(0.0005)
+    timing = mktiming(cfg, k)
+    filltrain(cfg, k, timing, np.zeros(timing[0] + 4)) # Compile, if needed
+    for func in [_filltrain_py, filltrain]:
+        vvv = np.zeros(timing[0] + 4)
+        t0 = time.time()
+        func(cfg, k, timing, vvv)
+        print(f'{func.__name__}: {time.time() - t0:.3f} s for 10000 pulses')
+
+    # Changing a parameter in place must not return stale timing
+    cfg.train[k].ipi_s.base = 0.02
+    assert mktiming(cfg, k)[0] == _mktiming_py(cfg, k)[0] != timing[0]
+    cfg.train[k].ipi_s.base = 0.01
+    for label, func in [('_mktiming_py', _mktiming_py),
+                        ('mktiming (uncached)', mktiming),
+                        ('mktiming (cached)', mktiming)]:
+        _timing.cache_clear()
+        if label.endswith('(cached)'):
+            mktiming(cfg, k)
+        t0 = time.time()
+        for n in range(10):
+            func(cfg, k)
+            if label.endswith('(uncached)'):
+                _timing.cache_clear()
+        print(f'{label}: {1e3*(time.time() - t0)/10:.3f} ms for 10000 pulses')
@@ -31,7 +31,7 @@ class ESPDataSink(QObject):
         QObject.__init__(self)
         self.cfg = cfg
         self.running = False
-        self.dat = None
+        self.stim = None
         self.t_end_s = None
 
     def reconfig(self):
@@ -39,16 +39,8 @@ class ESPDataSink(QObject):
                     if x is not None]
         self.nchans = len(self.idx)
         self.chans = [self.cfg.conn.hw[k] for k in self.idx]
-        self.nscans = 0
-        for k in range(self.nchans):
-            timing = espconfig.mktiming(self.cfg, self.idx[k])
-            if timing[0]>self.nscans:
-                self.nscans = timing[0]
-        self.dat = np.zeros((self.nscans+4, self.nchans))
-        for k in range(self.nchans):
-            timing = espconfig.mktiming(self.cfg, self.idx[k])
-            espconfig.filltrain(self.cfg, self.idx[k], timing,
-                                self.dat[:,k])
+        self.stim = espconfig.StimStream(self.cfg, self.idx)
+        self.nscans = self.stim.nscans
         self.t_end_s = self.nscans/self.cfg.hw.genrate.value
 
     def join(self, acqtask):
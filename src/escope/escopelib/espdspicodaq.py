@@ -34,4 +34,4 @@ class ESPDS_Picodaq_Joint(ESPDS_Dummy):
         """
         if self.cfg.hw.adapter == self.reccfg.hw.adapter:
             print("join", self.chans)
-            acqtask.feedstimdata(self.dat)
+            acqtask.feedstimdata(self.stim)
@@ -36,7 +36,7 @@ class ESPDS_xxdaq(ESPDataSink):
             chs.append(self.cfg.hw.channels[int(hw)])
         self.gentask = self.GenTask(dev, chs,
                                     self.cfg.hw.genrate.value,
-                                    self.dat)
+                                    self.stim)
 
     def run(self):
         #print 'espds: run'
@@ -15,5 +15,117 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 
 
-from .espqgraph import ESPGraph
+# espgraph.py - Graph widget for ESpark, with a choice of backends
 
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+BACKENDS = ['pyqtgraph', 'matplotlib']
+_backend = 'pyqtgraph'
+
+def setBackend(name):
+    """Select the backend for graphs created from now on
+
+    NAME must be one of BACKENDS. The default is “pyqtgraph”, which
+    builds and redraws much faster than “matplotlib”.
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown graph backend: {name}")
+    _backend = name
+
+def backend():
+    return _backend
+
+def _backendclass(name):
+    # Imported on demand, so only the backend in use gets loaded
+    if name=='pyqtgraph':
+        from . import espqgraph
+        return espqgraph.ESPGraph
+    elif name=='matplotlib':
+        from . import espmgraph
+        return espmgraph.ESPGraph
+    else:
+        raise ValueError(f"Unknown graph backend: {name}")
+
+class ESPGraph(QWidget):
+    """Graph for ESpark's previews
+
+    An ESPGraph holds a graph widget from one of the BACKENDS (by
+    default, the one selected with SETBACKEND) and passes plotting
+    calls on to it.
+    """
+    def __init__(self, parent=None, backend=None):
+        super().__init__(parent)
+        self.backend = _backend if backend is None else backend
+        self.impl = _backendclass(self.backend)()
+        lay = QVBoxLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        lay.addWidget(self.impl)
+        self.setMinimumSize(self.impl.minimumSize())
+        self.setMaximumSize(self.impl.maximumSize())
+        self.setSizePolicy(self.impl.sizePolicy())
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+
+    def setXLabel(self, s):
+        self.impl.setXLabel(s)
+
+    def setYLabel(self, s):
+        self.impl.setYLabel(s)
+
+    def cla(self):
+        self.impl.cla()
+
+    def plot(self, x, y, col=[0.,0.,1.], thin=False):
+        """Plot a line in color COL
+
+        THIN lines draw much faster, which matters for overlays of
+        many pulses.
+        """
+        return self.impl.plot(x, y, col, thin)
+
+    def autolim(self):
+        self.impl.autolim()
+
+    def noticks(self):
+        self.impl.noticks()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from . import espconfig
+    from .esptraingraph import ESPTrainGraph
+    from .esppulsegraph import ESPPulseGraph
+    # Compare rebuild latency of the backends on a heavy stimulus:
+    # 100 trains of 100 sine pulses, with the amplitude varying
+    # between pulses and between trains.
+    app = QApplication(sys.argv)
+    cfg = espconfig.basicconfig()
+    cfg.hw.genrate.value = 100000
+    k = 0
+    cfg.pulse[k].type = espconfig.Pulsetype(espconfig.Pulsetype.SINE)
+    cfg.train[k].ntrains = espconfig.Monovalue(100)
+    cfg.train[k].period_s = espconfig.Bivalue(1)
+    cfg.train[k].npulses = espconfig.Bivalue(100)
+    cfg.train[k].ipi_s = espconfig.Trivalue(0.005)
+    cfg.pulse[k].amp1_u = espconfig.Trivalue(1, 0.01, 0.001)
+    cfg.pulse[k].dur1_s = espconfig.Trivalue(0.001)
+    for name in BACKENDS:
+        setBackend(name)
+        for cls in [ESPTrainGraph, ESPPulseGraph]:
+            g = cls(cfg, k)
+            g.resize(1200, 250)
+            g.show()
+            g.rebuild()
+            app.processEvents()
+            N = 5
+            t0 = time.time()
+            for n in range(N):
+                g.rebuild()
+                g.repaint()
+                app.processEvents()
+            dt = (time.time() - t0) / N
+            print(f"{name:10s} {cls.__name__:14s} {1e3*dt:6.1f} ms")
+            g.close()
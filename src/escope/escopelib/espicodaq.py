@@ -24,6 +24,8 @@ from numpy.typing import ArrayLike
 from typing import List, Optional, Tuple, Callable
 from PyQt5.QtCore import QTimer, pyqtSignal, Qt, QProcess
 import time
+import itertools
+import functools
 
 try:
     import picodaq
@@ -49,29 +51,29 @@ def deviceList() -> List[str]:
     return devs
 
 
-def devAIChannels(dev: str) -> List[str]:
+@functools.lru_cache(maxsize=None)
+def _deviceinfo(dev: str) -> dict:
+    # Opening the port is slow, so do it once per device
     if dev.startswith("ACM"):
         dev = "/dev/tty" + dev
     p = picodaq.device.PicoDAQ(dev)
-    info = p.deviceinfo()
+    return p.deviceinfo()
+
+
+def devAIChannels(dev: str) -> List[str]:
+    info = _deviceinfo(dev)
     nAIchannels = int(info['AI'])
     return [f"ai{k}" for k in range(nAIchannels)]
 
 
 def devAOChannels(dev: str) -> List[str]:
-    if dev.startswith("ACM"):
-        dev = "/dev/tty" + dev
-    p = picodaq.device.PicoDAQ(dev)
-    info = p.deviceinfo()
+    info = _deviceinfo(dev)
     nAOchannels = int(info['AO'])
     return [f"ao{k}" for k in range(nAOchannels)]
 
 
 def devDOChannels(dev: str) -> List[str]:
-    if dev.startswith("ACM"):
-        dev = "/dev/tty" + dev
-    p = picodaq.device.PicoDAQ(dev)
-    info = p.deviceinfo()
+    info = _deviceinfo(dev)
     nDOchannels = int(info['DO'])
     return [f"do{k}" for k in range(nDOchannels)]
 
@@ -94,6 +96,7 @@ class ContAcqTask:
         self.running = False
         self.stimcfg = None
         self.ochans: List[str] = [] # "aox" and "dox"
+        self.stimblocks = None # generator of output blocks yet to be fed
         self.timer = None
 
     def __del__(self):
@@ -135,16 +138,45 @@ class ContAcqTask:
         self.pd.setProcessChannelMode(QProcess.ForwardedErrorChannel)
         self.prepped = True
 
-    def feedstimdata(self, data: ArrayLike) -> None:
+    def feedstimdata(self, data) -> None:
         """Add data to output queue
-        Shape of data must match config
+        Shape of data must match config. DATA may be a TxC array or
+        an espconfig.StimStream. In the latter case, output is
+        synthesized in blocks as the pdserver process consumes it, so
+        that no more than MAXPENDING bytes are waiting at any time.
         """
-        print("espicodaq feedstimdata", data.shape, np.std(data, 0))
         if not self.pd:
             raise RuntimeError("Not prepared")
+        if isinstance(data, np.ndarray):
+            print("espicodaq feedstimdata", data.shape, np.std(data, 0))
+            self.writestim(data)
+        else:
+            print("espicodaq feedstimdata", len(data), data.nchans())
+            if self.stimblocks is None:
+                self.pd.bytesWritten.connect(self.feedmore)
+                self.stimblocks = data.blocks()
+            else:
+                self.stimblocks = itertools.chain(self.stimblocks,
+                                                  data.blocks())
+            self.feedmore()
+
+    MAXPENDING = 1024*1024
+
+    def writestim(self, data: ArrayLike) -> None:
         bts = data.astype(np.float32).tobytes()
         if self.pd.write(bts) != len(bts):
             raise RuntimeError("Failed to write to picoDAQ process")
+
+    def feedmore(self, *args) -> None:
+        if self.stimblocks is None or self.pd is None:
+            return
+        while self.pd.bytesToWrite() < self.MAXPENDING:
+            blk = next(self.stimblocks, None)
+            if blk is None:
+                self.stimblocks = None
+                self.pd.bytesWritten.disconnect(self.feedmore)
+                return
+            self.writestim(blk)
             
     def run(self) -> None:
         print("espicodaq run")
@@ -182,6 +214,7 @@ class ContAcqTask:
         if self.prepped:
             self.prepped = False
             self.pd = None
+            self.stimblocks = None
     
     def getData(self, dst: np.ndarray) -> int:
         if not self.running:
@@ -50,8 +50,8 @@ class ESPGraph(FigureCanvas):
         for s in self.axes.spines.values():
             s.set_color('#000000')
 
-    def plot(self,x,y, col=[0.,0.,1.]):
-        return self.axes.plot(x,y, color=col)
+    def plot(self,x,y, col=[0.,0.,1.], thin=False):
+        return self.axes.plot(x,y, color=col, linewidth=.5 if thin else None)
 
     def autolim(self):
         self.axes.axis('tight')
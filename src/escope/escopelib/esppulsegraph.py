@@ -47,18 +47,15 @@ class ESPPulseGraph(ESPGraph):
             scl *= 1000.
         
         if self.cfg.pulse[self.k].type.value:
-            for itr in range(1,int(self.cfg.train[self.k].ntrains.base)):
-                for ipu in range(1,int(self.cfg.train[self.k].npulses.base +
-                                       itr*
-                                       self.cfg.train[self.k].npulses.delta)):
-                    (xx, yy) = espconfig.mkpulse(self.cfg, self.k, itr, ipu)
-                    self.plot(xx*1e3, yy*scl, [.7, .7, .7])
-            for itr in range(1,int(self.cfg.train[self.k].ntrains.base)):
-                (xx, yy) = espconfig.mkpulse(self.cfg, self.k, itr, 0)
-                self.plot(xx*1e3, yy*scl, [.4, .4, .4])
-            for ipu in range(1,int(self.cfg.train[self.k].npulses.base)):
-                (xx, yy) = espconfig.mkpulse(self.cfg, self.k, 0, ipu)
-                self.plot(xx*1e3, yy*scl, [.3, .5, 1])
+            # One plot call per color, rather than one per pulse
+            itr, ipu = espconfig.pulseindices(self.cfg, self.k)
+            for use, color in [((itr>0) & (ipu>0), [.7, .7, .7]),
+                               ((itr>0) & (ipu==0), [.4, .4, .4]),
+                               ((itr==0) & (ipu>0), [.3, .5, 1])]:
+                if np.any(use):
+                    (xx, yy) = espconfig.mkpulses(self.cfg, self.k,
+                                                  itr[use], ipu[use])
+                    self.plot(xx*1e3, yy*scl, color, thin=True)
             
             (xx, yy) = espconfig.mkpulse(self.cfg, self.k, 0, 0)
             self.plot(xx*1e3, yy*scl)
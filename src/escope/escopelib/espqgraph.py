@@ -19,6 +19,8 @@ import numpy as np
 import pyqtgraph as pg
 from PyQt5.QtGui import QPen, QColor, QPalette
 from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QWidget, QHBoxLayout
+import sys
 
 
 pg.setConfigOption('background', '#f8f8f8')
@@ -41,17 +43,35 @@ class ESPGraph(pg.PlotWidget):
         
     def cla(self):
         self.plotItem.clear()
+        self.plotItem.getViewBox().setBackgroundColor('#ffffff')
+        for ax in ['bottom', 'left']:
+            axis = self.plotItem.getAxis(ax)
+            axis.setTicks(None)
+            axis.setStyle(showValues=True)
+            axis.setPen()
 
-    def plot(self, x, y, col=[0.,0.,1.]):
-        pen = pg.mkPen(color=[int(255*c) for c in col], width=3)
-        h = self.plotItem.plot(x, y, pen=pen)
+    def plot(self, x, y, col=[0.,0.,1.], thin=False):
+        pen = pg.mkPen(color=[int(255*c) for c in col], width=1 if thin else 3)
+        h = self.plotItem.plot(x, y, pen=pen, connect='finite') # NaN = break
+        # Clipping and downsampling presume sorted x without gaps, so
+        # leave NaN-separated collections of pulses alone
+        x = np.asarray(x)
+        if len(x) > 1 and np.all(np.diff(x) >= 0) \
+           and np.all(np.isfinite(y)):
+            h.setClipToView(True)
+            h.setDownsampling(auto=True, method='peak')
         return h
 
     def autolim(self):
-        pass
+        self.plotItem.getViewBox().autoRange(padding=0.05)
 
     def noticks(self):
-        pass
+        for ax in ['bottom', 'left']:
+            axis = self.plotItem.getAxis(ax)
+            axis.setTicks([])
+            axis.setStyle(showValues=False)
+            axis.setPen('#aaaaaa')
+        self.plotItem.getViewBox().setBackgroundColor('#f8f8f8')
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
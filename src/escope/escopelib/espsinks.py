@@ -18,13 +18,14 @@
 # espsinks.py
 
 from . import espdatasink
-from . import espdsnidaq
-from . import espdspicodaq
 
 def makeDataSink(cfg, reccfg=None):
+    # Hardware modules are imported only when needed
     if cfg.hw.adapter[0]=='nidaq':
+        from . import espdsnidaq
         return espdsnidaq.ESPDS_Nidaq(cfg)
     elif cfg.hw.adapter[0]=='picodaq':
+        from . import espdspicodaq
         if reccfg and reccfg.hw.adapter == cfg.hw.adapter:
             return espdspicodaq.ESPDS_Picodaq_Joint(cfg, reccfg)
         else:
@@ -26,9 +26,15 @@ import numpy as np
 
 class ESPTrainGraph(ESPGraph):
     def __init__(self, cfg, k, parent=None):
+        self.npix = None # Resolution of the most recent rebuild
         ESPGraph.__init__(self, parent)
         self.cfg = cfg
         self.k = k
+
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        if self.npix is not None and self.width() > self.npix:
+            self.rebuild()
         
     def rebuild(self):
         self.cla()
@@ -67,17 +73,21 @@ class ESPTrainGraph(ESPGraph):
             else:
                 txp1color = t1p1color
                 txpxcolor = t1pxcolor
+            # Decimate to screen resolution, with room to grow
+            self.npix = max(self.width(), 1000)
+            (xx, yy) = espconfig.decimate(xx, yy, self.npix)
             self.plot(xx, yy*scl, txpxcolor)
             timing = espconfig.mktiming(self.cfg, self.k)
-            for itr in range(1, int(train.ntrains.base)):
-                (xx, yy) = espconfig.mkpulse(self.cfg, self.k, itr, 0,
-                                             margin=False)
-                self.plot(xx + timing[1][itr,0] / fs_hz,
-                          yy * scl, txp1color)
-            for ipu in range(1, int(train.npulses.base)):
-                (xx, yy) = espconfig.mkpulse(self.cfg, self.k, 0, ipu,
-                                             margin=False)
-                self.plot(xx+timing[1][0,ipu]/fs_hz, yy*scl, t1pxcolor)
+            itr = np.arange(1, int(train.ntrains.base))
+            (xx, yy) = espconfig.mkpulses(self.cfg, self.k, itr, 0,
+                                          margin=False,
+                                          t0=timing[1][itr,0] / fs_hz)
+            self.plot(xx, yy*scl, txp1color)
+            ipu = np.arange(1, int(train.npulses.base))
+            (xx, yy) = espconfig.mkpulses(self.cfg, self.k, 0, ipu,
+                                          margin=False,
+                                          t0=timing[1][0,ipu] / fs_hz)
+            self.plot(xx, yy*scl, t1pxcolor)
             (xx, yy) = espconfig.mkpulse(self.cfg, self.k, 0, 0,
                                          margin=False)
             self.plot(xx+timing[1][0,0]/fs_hz, yy*scl, t1p1color)
@@ -0,0 +1,167 @@
+# esscopegl.py - This file is part of EScope/ESpark
+# (C) 2024  Daniel A. Wagenaar
+#
+# EScope and ESpark are free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# EScope and ESpark are distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+
+
+# esscopegl.py - OpenGL renderer for ESScopeWin
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+import numpy as np
+
+# The function tables from QOpenGLContext.versionFunctions do not carry
+# the OpenGL enums, so we define the ones we use here.
+GL_POINTS = 0x0000
+GL_LINES = 0x0001
+GL_LINE_STRIP = 0x0003
+GL_LINE_STIPPLE = 0x0B24
+GL_FLOAT = 0x1406
+GL_MODELVIEW = 0x1700
+GL_PROJECTION = 0x1701
+GL_COLOR_BUFFER_BIT = 0x4000
+GL_VERTEX_ARRAY = 0x8074
+
+
+def available():
+    """Whether a context with OpenGL 2.0 functions can be created
+
+    Creating a context is not enough: on OpenGL ES, for instance, the
+    fixed-function calls we rely on are missing.
+    """
+    ctx = QOpenGLContext()
+    if not ctx.create() or ctx.isOpenGLES():
+        return False
+    prof = QOpenGLVersionProfile()
+    prof.setVersion(2, 0)
+    return ctx.versionFunctions(prof) is not None
+
+
+class ESScopeGL(QOpenGLWidget):
+    """OpenGL rendering for ESScopeWin
+
+    An ESScopeGL is placed as a child on top of an ESScopeWin and
+    draws the grid, traces, and cursors of its parent. All the
+    bookkeeping (data, envelopes, cursors, mouse handling) remains
+    with the ESScopeWin; this widget only replaces its paintEvent.
+
+    Each trace is uploaded as a single vertex array, so that the
+    number of draw calls does not depend on the width of the display.
+    """
+
+    def __init__(self, win):
+        super().__init__(win)
+        self.win = win
+        self.gl = None
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+
+    def initializeGL(self):
+        prof = QOpenGLVersionProfile()
+        prof.setVersion(2, 0)
+        self.gl = self.context().versionFunctions(prof)
+        if self.gl is None:
+            print("Could not obtain OpenGL 2.0 functions")
+            return
+        self.gl.initializeOpenGLFunctions()
+
+    def paintGL(self):
+        gl = self.gl
+        if gl is None:
+            return
+        wp = self.width()
+        hp = self.height()
+        dpr = self.devicePixelRatioF()
+        gl.glViewport(0, 0, int(wp*dpr), int(hp*dpr))
+        gl.glMatrixMode(GL_PROJECTION)
+        gl.glLoadIdentity()
+        gl.glOrtho(0, wp, hp, 0, -1, 1)
+        gl.glMatrixMode(GL_MODELVIEW)
+        gl.glLoadIdentity()
+        gl.glClearColor(0, 0, 0, 1)
+        gl.glClear(GL_COLOR_BUFFER_BIT)
+        self._drawGridLines()
+        self._drawTraces()
+        self._drawCursors()
+
+    def _drawArray(self, mode, vv):
+        gl = self.gl
+        vv = np.asarray(vv, dtype=np.float32)
+        gl.glEnableClientState(GL_VERTEX_ARRAY)
+        # PyQt5 crashes when given a buffer here, but copies a list of
+        # floats into an array that it keeps alive for us
+        gl.glVertexPointer(2, GL_FLOAT, 0, vv.ravel().tolist())
+        gl.glDrawArrays(mode, 0, len(vv))
+        gl.glDisableClientState(GL_VERTEX_ARRAY)
+
+    def _setColor(self, c):
+        self.gl.glColor3f(c.redF(), c.greenF(), c.blueF())
+
+    def _drawGridLines(self):
+        gl = self.gl
+        wp = self.width()
+        hp = self.height()
+        xps, yps, yzero = self.win._gridPositions()
+        vv = []
+        for xp in xps:
+            vv += [(xp + .5, 0), (xp + .5, hp)]
+        for yp in yps:
+            vv += [(0, yp + .5), (wp, yp + .5)]
+        self._setColor(QColor("#aaaaaa"))
+        gl.glEnable(GL_LINE_STIPPLE)
+        gl.glLineStipple(1, 0x3333)
+        self._drawArray(GL_LINES, vv)
+        gl.glDisable(GL_LINE_STIPPLE)
+        self._drawArray(GL_LINES, [(0, yzero + .5), (wp, yzero + .5)])
+
+    def _drawTraces(self):
+        gl = self.gl
+        win = self.win
+        cols = win._traceColumns()
+        if cols is None:
+            return
+        xx, yy = win._traceCoordinates(*cols)
+        xx = xx + .5
+        N = len(xx)
+        vv = np.empty((2*N, 2), np.float32)
+        for k in range(len(yy)):
+            self._setColor(win.cc[k])
+            ylo, yhi = yy[k]
+            if win.dispStyle == 2:
+                # True blue: one vertical line per column, spanning
+                # the envelope, and at least one pixel long.
+                vv[0::2, 0] = xx
+                vv[0::2, 1] = np.floor(yhi)
+                vv[1::2, 0] = xx
+                vv[1::2, 1] = np.floor(ylo) + 1
+                self._drawArray(GL_LINES, vv)
+            else:
+                vv[:N, 0] = xx
+                vv[:N, 1] = np.floor(ylo) + .5
+                if win.dispStyle == 0:
+                    self._drawArray(GL_POINTS, vv[:N])
+                else:
+                    self._drawArray(GL_LINE_STRIP, vv[:N])
+
+    def _drawCursors(self):
+        win = self.win
+        if win.cursorx is None:
+            return
+        hp = self.height()
+        vv = [(win.cursorx + .5, 0), (win.cursorx + .5, hp)]
+        if win.cursorx0 is not None:
+            vv += [(win.cursorx0 + .5, 0), (win.cursorx0 + .5, hp)]
+        self._setColor(QColor(255, 255, 255))
+        self._drawArray(GL_LINES, vv)
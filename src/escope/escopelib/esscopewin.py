@@ -21,6 +21,7 @@ from PyQt5.QtWidgets import *
 
 import numpy as np
 import sys
+import time
 
 from . import esconfig
 
@@ -30,103 +31,46 @@ try:
 except ModuleNotFoundError:
     havejit = False
 
-lastkk = None
-lastX = -1
-lastY = -1
-    
-if havejit:    
-    @jit(nopython=True)
-    def trueblue(xx, ichn, yy):
-        X = xx.shape[0]
-        Y = len(yy)//2
-        if Y==0 or X==0:
-            return
-        i0 = 0
-        for k in range(Y):
-            i1 = (k+1)*X//Y
-            ymin = xx[i0, ichn]
-            ymax = ymin
-            for n in range(i0+1, i1):
-                x = xx[n,ichn]
-                if x < ymin:
-                    ymin = xx[n, ichn]
-                elif x>ymax:
-                    ymax = x
-            yy[k] = ymin
-            yy[2*Y-1-k] = ymax
-            i0 = i1
-else:
-    def trueblue(xx, ichn, yy):
-        global lastkk, lastX, lastY
-        X = xx.shape[0]
-        Y = len(yy)//2
-        if Y==0 or X==0:
-            return
-        if lastX != X or lastY != Y:
-            lastX = X
-            lastY = Y
-            lastkk = np.floor(np.arange(Y+1) * X/Y).astype(int)
-        if Y > X:
-            print(yy.shape, Y)
-            yy[:Y] = xx[lastkk[:-1], ichn]
-            yy[2*Y:Y-1:-1] = xx[lastkk[:-1], ichn]
-        else:
-            k0 = lastkk[0]
-            for j in range(Y):
-                k1 = lastkk[j+1]
-                yy[j] = np.min(xx[k0:k1, ichn])
-                yy[2*Y-1-j] = np.max(xx[k0:k1, ichn])
-                k0 = k1
-
-                
-def sample(xx, ichn, yy):
-    global lastkk, lastX, lastY
-    X = xx.shape[0]
-    Y = len(yy)
-    if Y==0 or X==0:
-        return
-    if lastX != X or lastY != Y:
-        lastX = X
-        lastY = Y
-        lastkk = np.floor(np.arange(Y+1) * X/Y).astype(int)
-    yy[:Y] = xx[lastkk[:-1], ichn]
-
+# ENVELOPE(xx, ichn, kk, c0, c1, ymin, ymax) fills YMIN[c] and YMAX[c]
+# with the minimum and maximum of XX[KK[c]:KK[c+1], ICHN] for columns
+# C0 ≤ c < C1. A column that contains no samples takes the value of the
+# sample at KK[c].
 
 if havejit:
     @jit(nopython=True)
-    def limpoly1(yy, ymin, ymax):
-        Y = len(yy)
-        Y2 = len(yy)-1
-        for k in range(Y):
-            if yy[k]<=ymin:
-                yy[k] = ymin
-            elif yy[k]>=ymax:
-                yy[k] = ymax
+    def envelope(xx, ichn, kk, c0, c1, ymin, ymax):
+        for c in range(c0, c1):
+            k0 = kk[c]
+            lo = xx[k0, ichn]
+            hi = lo
+            for n in range(k0+1, kk[c+1]):
+                x = xx[n, ichn]
+                if x < lo:
+                    lo = x
+                elif x > hi:
+                    hi = x
+            ymin[c] = lo
+            ymax[c] = hi
+else:
+    def envelope(xx, ichn, kk, c0, c1, ymin, ymax):
+        if c1 <= c0:
+            return
+        n0 = kk[c0]
+        n1 = max(kk[c1], kk[c1-1] + 1)
+        seg = xx[n0:n1, ichn]
+        idx = kk[c0:c1] - n0
+        ymin[c0:c1] = np.minimum.reduceat(seg, idx)
+        ymax[c0:c1] = np.maximum.reduceat(seg, idx)
 
 
-    @jit(nopython=True)
-    def limpoly2(yy, ymin, ymax):
-        Y = len(yy)/2
-        Y2 = len(yy)-1
-        for k in range(Y):
-            if yy[k]<=ymin:
-                yy[k] = ymin
-                yy[Y2-k] = ymin
-            elif yy[Y2-k]>=ymax:
-                yy[k] = ymax
-                yy[Y2-k] = ymax
-else:
-    def limpoly1(yy, ymin, ymax):
-        yy = np.clip(yy, ymin, ymax)
+def sample(xx, ichn, kk, c0, c1, yy):
+    yy[c0:c1] = xx[kk[c0:c1], ichn]
 
-    def limpoly2(yy, ymin, ymax):
-        yy = np.clip(yy, ymin, ymax)
 
-        
-def mkpoly(xx,yy,offset,scale, hp):
+def mkpoly(xx, yy):
     poly = QPolygon(len(xx))
     for k in range(len(xx)):
-        poly.setPoint(k, int(xx[k]), int(offset+scale*yy[k]))
+        poly.setPoint(k, int(xx[k]), int(yy[k]))
     return poly
 
 
@@ -147,37 +91,63 @@ class ESScopeWin(QWidget):
         self.dat = None
         self.dat_pre_s = 0
         self.dat_post_s = 0
-        self.yy = None
-        self.xx = None
+        self.envkey = None # Geometry for which the envelopes are valid
+        self.envlo = 0 # Range of rows in dat that still need to be
+        self.envhi = 0 # ... folded into the envelopes
         self.src = None
         self.cc = None
         self.traces = None
         self.write_idx = None
         #self.mutex = QMutex()
         self.dispStyle = 0
-        # Display styles: 0=dots, 1=lines, 2=true blue
+        # Display styles: 0=dots, 1=lines, 2=true blue, 3=persistence
         self.quitting = False
         self.cursorx0 = None
         self.cursorx = None
+        self.gl = None # Optional OpenGL renderer, see setOpenGL
+        self.gridpix = None # Cached rendering of the grid
+        self.gridkey = None # Configuration for which gridpix is valid
+        self.tracepix = None # Cached rendering of grid and traces
+        self.tracedirty = QRect() # Part of tracepix that needs redrawing
+        self.maxfps = 50
+        self.frametimer = QTimer(self)
+        self.frametimer.setSingleShot(True)
+        self.frametimer.timeout.connect(self._presentFrame)
+        self.framerect = QRect() # Area to be repainted at the next frame
+        self.lastframe_t = 0 # Time at which we last presented a frame
+        self.sweeppending = False # Completed sweep not yet on screen
+        self.nskipped = 0
+        self.nframes = 0
+        self.fps_t0 = time.monotonic()
+        self.fps = 0
+        self.persist_s = 1 # Decay time constant for persistence display
+        self.pers = None # Accumulated hits for persistence display
+        self.persdiff = None # Hits not yet folded into pers
+        self.pers_t = None # Time at which pers was last brought up to date
+        self.spikes = None # Optional ESSpikeStage from our source
+        self.sweep0 = 0 # Scan index (in the source) of row 0 of dat
+        self.disp0 = 0 # ... and of the data currently on screen
         self.setMouseTracking(True)
 
     def mousePressEvent(self, evt):
         if evt.button()==Qt.LeftButton:
-            self.cursorx0 = evt.pos().x()
-            self.update()
-            self.cursorsMoved.emit()
+            self._moveCursors(self.cursorx, evt.pos().x())
 
     def mouseReleaseEvent(self, evt):
         if evt.button()==Qt.LeftButton:
-            self.cursorx0 = None
-            self.update()
-            self.cursorsMoved.emit()
+            self._moveCursors(self.cursorx, None)
 
     def setDisplayStyle(self, sty):
         self.dispStyle = sty
-        self.xx = None
-        self.yy = None
-        self.update()
+        self._invalidateEnvelope()
+        if self.gl is not None:
+            # Persistence is always drawn through QPainter
+            self.gl.setVisible(sty != 3)
+        self._redraw()
+
+    def setPersistence(self, tau_s):
+        """Set the decay time constant of the persistence display"""
+        self.persist_s = tau_s
 
     def closeEvent(self, evt):
         if not self.quitting:
@@ -185,14 +155,22 @@ class ESScopeWin(QWidget):
             QApplication.quit()
 
     def leaveEvent(self, evt):
-        self.cursorx0 = None
-        self.cursorx = None
-        self.update()
-        self.cursorsMoved.emit()
+        self._moveCursors(None, None)
 
     def mouseMoveEvent(self, evt):
-        self.cursorx = evt.pos().x()
-        self.update()
+        self._moveCursors(evt.pos().x(), self.cursorx0)
+
+    def _moveCursors(self, cx, cx0):
+        """Move the cursors, repainting only the columns they touch"""
+        if self.gl is None:
+            hp = self.height()
+            for x in {self.cursorx, self.cursorx0, cx, cx0}:
+                if x is not None:
+                    self.update(x - 1, 0, 3, hp)
+        else:
+            self.update()
+        self.cursorx = cx
+        self.cursorx0 = cx0
         self.cursorsMoved.emit()
 
     def dataAt(self, xdiv):
@@ -235,12 +213,151 @@ class ESScopeWin(QWidget):
         trgx = self.cfg.trig.delay_div
         return cx, cx0, trgx
 
+    def setOpenGL(self, on=True):
+        """Render through OpenGL rather than QPainter
+
+        If OpenGL is not available, we silently stay with QPainter.
+        Returns True if OpenGL rendering is in use.
+        """
+        if on and self.gl is None:
+            from . import esscopegl
+            if esscopegl.available():
+                self.gl = esscopegl.ESScopeGL(self)
+                self.gl.resize(self.size())
+                self.gl.show()
+            else:
+                print("OpenGL not available")
+        elif not on and self.gl is not None:
+            self.gl.hide()
+            self.gl.deleteLater()
+            self.gl = None
+        self._redraw()
+        return self.gl is not None
+
+    def setMaxFPS(self, fps):
+        """Limit the rate at which new data are drawn
+
+        Data arriving faster than this are accumulated, and sweeps
+        that complete faster than this are counted but not drawn.
+        """
+        self.maxfps = fps
+
+    def achievedFPS(self):
+        """Rate at which new data were drawn over the last second or so"""
+        dt = time.monotonic() - self.fps_t0
+        if dt >= 2:
+            # No frames for a while, so our last estimate is stale
+            return self.nframes / dt
+        return self.fps
+
+    def skippedSweeps(self):
+        """Number of sweeps since startRun that were never drawn"""
+        return self.nskipped
+
+    def _requestFrame(self, rect=None):
+        """Schedule a repaint of RECT (default: everything)
+
+        The repaint happens right away unless that would exceed our
+        maximum frame rate, in which case it is postponed. Requests
+        that arrive in the mean time are merged.
+        """
+        if rect is None:
+            rect = self.rect()
+        self.framerect = self.framerect.united(rect)
+        if self.frametimer.isActive():
+            return
+        wait_s = self.lastframe_t + 1/self.maxfps - time.monotonic()
+        if wait_s > 0:
+            self.frametimer.start(int(np.ceil(1000*wait_s)))
+        else:
+            self._presentFrame()
+
+    def _presentFrame(self):
+        if self.framerect.isEmpty():
+            return
+        self._redraw(self.framerect)
+        self.framerect = QRect()
+        self.sweeppending = False
+        now = time.monotonic()
+        self.lastframe_t = now
+        self.nframes += 1
+        if now - self.fps_t0 >= 1:
+            self.fps = self.nframes / (now - self.fps_t0)
+            self.nframes = 0
+            self.fps_t0 = now
+
+    def _redraw(self, rect=None):
+        """Schedule a repaint of RECT (default: everything)
+
+        Unlike plain update(), this also rerenders the traces.
+        """
+        if rect is None:
+            rect = self.rect()
+        self.tracedirty = self.tracedirty.united(rect)
+        self.update(rect)
+
     def paintEvent(self, evt):
+        if self.gl is not None and self.dispStyle != 3:
+            self.gl.update()
+            return
+        self._renderLayers()
         p = QPainter(self)
-        self._drawGridLines(p)
-        self._drawTraces(p)
+        p.drawPixmap(0, 0, self.tracepix)
+        self._drawSpikes(p)
         self._drawCursors(p)
 
+    def _renderLayers(self):
+        """Bring our cached renderings of the grid and traces up to date
+
+        The cursors are not part of these, so moving the mouse only
+        costs a few blits.
+        """
+        dpr = self.devicePixelRatioF()
+        size = QSize(int(self.width() * dpr), int(self.height() * dpr))
+        key = esconfig.cachekey(size, self.cfg.hori.xlim, self.cfg.vert.ylim)
+        if key != self.gridkey:
+            self.gridpix = QPixmap(size)
+            self.gridpix.setDevicePixelRatio(dpr)
+            self.gridpix.fill(Qt.transparent)
+            p = QPainter(self.gridpix)
+            self._drawGridLines(p)
+            p.end()
+            self.gridkey = key
+            self.tracepix = QPixmap(size)
+            self.tracepix.setDevicePixelRatio(dpr)
+            self.tracedirty = self.rect()
+        if self.tracedirty.isEmpty():
+            return
+        rect = self.tracedirty
+        self.tracedirty = QRect()
+        p = QPainter(self.tracepix)
+        p.setClipRect(rect)
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        p.drawPixmap(0, 0, self.gridpix)
+        p.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        self._drawTraces(p, rect)
+
+    def _drawSpikes(self, p: QPainter):
+        """Tick marks at the top for spikes found by our ESSpikeStage"""
+        if self.spikes is None or self.envkey is None:
+            return
+        kk = self.envkk
+        for k, chan in enumerate(self.spikes.chans):
+            rows = self.spikes.spikes(k, self.disp0 + kk[0],
+                                      self.disp0 + kk[-1]) - self.disp0
+            if len(rows) == 0:
+                continue
+            xx = self.envx0 + np.searchsorted(kk, rows, 'right') - 1
+            y0 = 2 + 6*k
+            p.setPen(esconfig.color(self.cfg, chan))
+            p.drawLines([QLineF(x + .5, y0, x + .5, y0 + 4) for x in xx])
+
+    def _spikesDetected(self, tt):
+        if self.cfg.hori.s_div > 0.1 and self.dispStyle != 3:
+            rows = tt - self.disp0
+            self._requestFrame(self._dirtyRect(np.min(rows),
+                                               np.max(rows) + 1))
+
     def _drawCursors(self, p: QPainter):
         hp = self.height()
         if self.cursorx is not None:
@@ -250,11 +367,13 @@ class ESScopeWin(QWidget):
                 p.drawLine(self.cursorx0, 0, self.cursorx0, hp)
 
 
-    def _drawGridLines(self, p: QPainter):
-        pn = p.pen()
-        pn.setStyle(Qt.DotLine)
-        pn.setColor(QColor("#aaaaaa"))
-        p.setPen(pn)
+    def _gridPositions(self):
+        """Pixel positions of grid lines
+
+        Returns (xps, yps, yzero): the horizontal positions of the
+        vertical grid lines, the vertical positions of the horizontal
+        grid lines, and the vertical position of the zero line.
+        """
         x0 = self.cfg.hori.xlim[0] + 0.
         x1 = self.cfg.hori.xlim[1]
         y0 = self.cfg.vert.ylim[0] + 0.
@@ -262,42 +381,48 @@ class ESScopeWin(QWidget):
         wp = self.width()
         hp = self.height()
         
+        xps = []
         for x in np.arange(x0, x1+1e-10):
             xp = int(wp * (x-x0) / (x1-x0))
             if xp >= wp:
                 xp = wp - 1
-            p.drawLine(xp, 0, xp, hp)
+            xps.append(xp)
+        yps = []
         for y in np.arange(y0, y1+1e-10):
             yp = int(hp * (1 - (y-y0) / (y1-y0)))
             if yp >= hp:
                 yp = hp - 1
+            yps.append(yp)
+        yzero = int(hp * (1 + y0 / (y1 - y0)))
+        return xps, yps, yzero
+
+    def _drawGridLines(self, p: QPainter):
+        pn = p.pen()
+        pn.setStyle(Qt.DotLine)
+        pn.setColor(QColor("#aaaaaa"))
+        p.setPen(pn)
+        wp = self.width()
+        hp = self.height()
+        xps, yps, yzero = self._gridPositions()
+        for xp in xps:
+            p.drawLine(xp, 0, xp, hp)
+        for yp in yps:
             p.drawLine(0, yp, wp, yp)
         pn.setStyle(Qt.SolidLine)
         p.setPen(pn)
-        yp = int(hp * (1 + y0 / (y1 - y0)))
-        p.drawLine(0, yp, wp, yp)
+        p.drawLine(0, yzero, wp, yzero)
 
-    def _drawTraces(self, p):
-        # Draw traces
-        if self.dat is None:
-            return
-        if self.write_idx is None:
-            return
-        if self.write_idx <= 0:
-            return
+    def _traceGeometry(self):
+        """Where the data should be plotted
 
+        Returns (x0, x1, i0, i1) such that data in rows I0 up to I1 of
+        our buffer are to be drawn in pixel columns X0 up to X1.
+        """
         xlim0 = self.cfg.hori.xlim[0] + 0.
         xlim1 = self.cfg.hori.xlim[1]
-        dxlim = xlim1 - xlim0
-        y0 = self.cfg.vert.ylim[0] + 0.
-        y1 = self.cfg.vert.ylim[1]        
         wp = self.width()
-        hp = self.height()
-
-        nchan = self.dat.shape[1]
         sweep_s = self.cfg.hori.s_div * (xlim1 - xlim0)
 
-        # Let's find out where the data should be plotted
         # We have data starting at self.dat_pre before the trigger marker.
         # What we want to display is:
         want_pre_s = self.cfg.hori.s_div * (self.cfg.trig.delay_div - xlim0)
@@ -321,61 +446,251 @@ class ESScopeWin(QWidget):
             i1 = int(self.dat.shape[0]
                      - self.cfg.hw.acqrate.value
                      * (self.dat_post_s - want_post_s))
+        return x0, x1, i0, i1
+
+    def _invalidateEnvelope(self):
+        self.envkey = None
+        self.tracedirty = self.rect()
 
-        if self.dispStyle==2:
-            neededLength = 2*(x1-x0)
+    def _markDirty(self, n0, n1):
+        """Mark rows N0 up to N1 of our buffer as needing to be redrawn"""
+        if n1 <= n0:
+            return
+        if self.envhi <= self.envlo:
+            self.envlo = n0
+            self.envhi = n1
         else:
-            neededLength = (x1-x0)
-        if self.xx is None or (len(self.xx) > 0 and self.xx[0] != x0) \
-               or len(self.xx) != 2*(x1-x0):
-            if self.dispStyle == 2:
-                self.xx = np.hstack((np.arange(x0, x1),
-                                     np.arange(x1 - 1, x0 - 1, -1)))
+            self.envlo = min(self.envlo, n0)
+            self.envhi = max(self.envhi, n1)
+
+    def _envelopeKey(self):
+        return (self._traceGeometry(), self.dat.shape, self.dispStyle)
+
+    def _updateEnvelope(self):
+        """Bring the per-column envelopes up to date
+
+        Only the columns that contain rows marked by _markDirty are
+        recalculated, unless the geometry has changed, in which case
+        everything is.
+        """
+        key = self._envelopeKey()
+        x0, x1, i0, i1 = key[0]
+        nchan = self.dat.shape[1]
+        if key != self.envkey:
+            self.envkey = key
+            X = max(i1 - i0, 0)
+            Y = max(x1 - x0, 0)
+            self.envx0 = x0
+            self.envkk = i0 + np.floor(np.arange(Y+1) * X/max(Y, 1)).astype(int)
+            self.ymin = np.zeros((nchan, Y))
+            if self.dispStyle >= 2:
+                self.ymax = np.zeros((nchan, Y))
             else:
-                self.xx = np.arange(x0, x1)
-        if self.yy is None:
-            self.yy = [None] * nchan
+                self.ymax = self.ymin
+            self.acoffset = None
+            self.pers = None
+            self.envlo = i0
+            self.envhi = i1
+        if self.envhi <= self.envlo:
+            return
+        c0, c1 = self._dirtyColumns(self.envlo, self.envhi)
+        self.envlo = 0
+        self.envhi = 0
+        if c1 <= c0:
+            return
         for k in range(nchan):
-            if self.yy[k] is None or len(self.yy[k]) != len(self.xx):
-                self.yy[k] = np.zeros(self.xx.shape)
-            if self.dispStyle==2:
-                trueblue(self.dat[i0:i1,:], k, self.yy[k])
+            if self.dispStyle >= 2:
+                envelope(self.dat, k, self.envkk, c0, c1,
+                         self.ymin[k], self.ymax[k])
             else:
-                sample(self.dat[i0:i1,:], k, self.yy[k])
-
-        if self.yy is not None:
-            for k in range(len(self.yy)):
-                p.setBrush(self.cc[k])
-                p.setPen(self.cc[k])
-                trc = self.traces[k]
-                scl = -hp / self.cfg.vert.unit_div[trc] / (y1 - y0)
-                if self.cfg.vert.coupling[trc] == 2:
-                    v0 = np.mean(self.yy[k])
-                else:
-                    v0 = 0
-                off = hp * (y1 - self.cfg.vert.offset_div[trc]) / (y1 - y0) - scl * v0
-                if self.dispStyle==2:
-                    limpoly2(self.yy[k], (hp - 1 - off) / scl, -off / scl)
-                else:
-                    limpoly1(self.yy[k], (hp - 1 - off) / scl, -off / scl)
-                poly = mkpoly(self.xx, self.yy[k], off, scl, hp)
-                if self.dispStyle==0:
-                    # Dots
-                    p.drawPoints(poly)
-                elif self.dispStyle == 1:
-                    p.drawPolyline(poly)
-                else:
-                    # True blue
-                    p.drawPolygon(poly)
+                sample(self.dat, k, self.envkk, c0, c1, self.ymin[k])
+
+    def _dirtyColumns(self, n0, n1):
+        """Columns (c0, c1) affected by rows N0 up to N1 of our buffer"""
+        Y = len(self.envkk) - 1
+        if Y <= 0 or n1 <= self.envkk[0] or n0 >= self.envkk[-1]:
+            return 0, 0
+        c0 = np.searchsorted(self.envkk, n0, 'right') - 1
+        c1 = np.searchsorted(self.envkk, n1, 'left')
+        return max(c0, 0), min(c1, Y)
+
+    def _dirtyRect(self, n0, n1):
+        """Screen area affected by rows N0 up to N1 of our buffer"""
+        if self.envkey is None or self.envkey != self._envelopeKey():
+            return self.rect()
+        c0, c1 = self._dirtyColumns(n0, n1)
+        if c1 <= c0:
+            return QRect()
+        # Include neighboring columns so that lines join up cleanly
+        xa = self.envx0 + c0 - 2
+        xb = self.envx0 + c1 + 2
+        return QRect(xa, 0, xb - xa, self.height())
+
+    def _traceColumns(self, rect=None):
+        """Columns of the envelopes that need to be drawn
+
+        This brings the envelopes up to date and returns (c0, c1) or
+        None if there is nothing to draw. If RECT is given, only
+        columns that fall within it (plus a small margin) are included.
+        """
+        if self.dat is None:
+            return None
+        if self.write_idx is None:
+            return None
+        if self.write_idx <= 0:
+            return None
+
+        self._updateEnvelope()
+        
+        Y = self.ymin.shape[1]
+        if rect is None or rect.contains(self.rect()):
+            full = True
+            c0 = 0
+            c1 = Y
+        else:
+            # Only repaint what is needed, plus a margin on either side
+            full = False
+            c0 = max(rect.left() - self.envx0 - 2, 0)
+            c1 = min(rect.right() + 1 - self.envx0 + 2, Y)
+        if c1 <= c0:
+            return None
+
+        if full or self.acoffset is None:
+            # The AC offsets are only reevaluated on full repaints, so
+            # that partial repaints line up with what is on screen.
+            self.acoffset = (np.mean(self.ymin, 1) + np.mean(self.ymax, 1)) / 2
+        return c0, c1
+
+    def _traceCoordinates(self, c0, c1):
+        """Screen coordinates of the traces for columns C0 up to C1
+
+        Returns xx, a vector of pixel positions, and a list of tuples
+        (ylo, yhi) for each trace. YLO and YHI are the pixel positions
+        of the minima and maxima of the envelope. (They are the same
+        object unless the display style is “true blue.”)
+        """
+        y0 = self.cfg.vert.ylim[0] + 0.
+        y1 = self.cfg.vert.ylim[1]        
+        hp = self.height()
+        xx = np.arange(self.envx0 + c0, self.envx0 + c1)
+        yy = []
+        for k in range(len(self.traces)):
+            trc = self.traces[k]
+            scl = -hp / self.cfg.vert.unit_div[trc] / (y1 - y0)
+            if self.cfg.vert.coupling[trc] == 2:
+                v0 = self.acoffset[k]
+            else:
+                v0 = 0
+            off = hp * (y1 - self.cfg.vert.offset_div[trc]) / (y1 - y0) - scl * v0
+            ylo = np.clip(off + scl * self.ymin[k, c0:c1], 0, hp - 1)
+            if self.dispStyle >= 2:
+                yhi = np.clip(off + scl * self.ymax[k, c0:c1], 0, hp - 1)
+            else:
+                yhi = ylo
+            yy.append((ylo, yhi))
+        return xx, yy
+
+    def _foldPersistence(self):
+        """Add the current sweep to the persistence display
+
+        Each column of the envelope, stretched to meet its neighbor,
+        adds a vertical run of hits. Rather than touching every pixel
+        of the run, we record its endpoints in persdiff; the runs are
+        filled in by a cumulative sum in _updatePersistence. Thus
+        the cost per sweep is proportional to the width of the display,
+        not its area. Decay is accounted for by giving later sweeps
+        exponentially larger weights until the next update.
+        """
+        cols = self._traceColumns()
+        if cols is None:
+            return
+        c0, c1 = cols
+        xx, yy = self._traceCoordinates(c0, c1)
+        K = len(yy)
+        H = self.height()
+        if self.pers is None or self.pers.shape != (K, H, c1 - c0):
+            self.pers = np.zeros((K, H, c1 - c0), np.float32)
+            self.persdiff = np.zeros((K, H + 1, c1 - c0), np.float32)
+            self.pers_t = time.monotonic()
+        elif time.monotonic() - self.pers_t > 10 * self.persist_s:
+            # Keep the weights from growing without bounds when we are
+            # not being painted
+            self._updatePersistence()
+        ylo = np.array([y[0] for y in yy])
+        yhi = np.array([y[1] for y in yy])
+        top = np.floor(np.minimum(ylo, yhi)).astype(int)
+        bot = np.floor(np.maximum(ylo, yhi)).astype(int)
+        top[:, :-1] = np.minimum(top[:, :-1], bot[:, 1:])
+        bot[:, :-1] = np.maximum(bot[:, :-1], top[:, 1:])
+        kk = np.arange(K).reshape(K, 1)
+        cc = np.arange(c1 - c0).reshape(1, -1)
+        wt = np.exp((time.monotonic() - self.pers_t) / self.persist_s)
+        self.persdiff[kk, top, cc] += wt
+        self.persdiff[kk, bot + 1, cc] -= wt
+
+    def _updatePersistence(self):
+        now = time.monotonic()
+        decay = np.exp(-(now - self.pers_t) / self.persist_s)
+        self.pers += np.cumsum(self.persdiff[:, :-1, :], 1)
+        self.pers *= decay
+        self.persdiff[:] = 0
+        self.pers_t = now
+
+    def _drawPersistence(self, p):
+        if self.pers is None and self.sweepIsComplete():
+            self._foldPersistence()
+        if self.pers is None:
+            return
+        self._updatePersistence()
+        K, H, W = self.pers.shape
+        ref = max(self.pers.max(), 1)
+        lum = np.log1p(self.pers) / np.float32(np.log1p(ref))
+        cc = np.array([[c.red(), c.green(), c.blue()] for c in self.cc[:K]],
+                      np.float32)
+        rgb = np.tensordot(lum, cc, (0, 0)) # Shape is H x W x 3
+        rgb = np.minimum(rgb, 255).astype(np.uint32)
+        argb = 0xff000000 | (rgb[:,:,0] << 16) | (rgb[:,:,1] << 8) | rgb[:,:,2]
+        img = QImage(argb.data, W, H, 4*W, QImage.Format_RGB32)
+        # Additive, so that the grid shows through the black background
+        p.setCompositionMode(QPainter.CompositionMode_Plus)
+        p.drawImage(self.envx0, 0, img)
+        p.setCompositionMode(QPainter.CompositionMode_SourceOver)
+
+    def _drawTraces(self, p, rect=None):
+        if self.dispStyle == 3:
+            self._drawPersistence(p)
+            return
+        cols = self._traceColumns(rect)
+        if cols is None:
+            return
+        xx, yy = self._traceCoordinates(*cols)
+        if self.dispStyle == 2:
+            xx = np.hstack((xx, xx[::-1]))
+        for k in range(len(yy)):
+            p.setBrush(self.cc[k])
+            p.setPen(self.cc[k])
+            ylo, yhi = yy[k]
+            if self.dispStyle == 2:
+                poly = mkpoly(xx, np.hstack((ylo, yhi[::-1])))
+            else:
+                poly = mkpoly(xx, ylo)
+            if self.dispStyle==0:
+                # Dots
+                p.drawPoints(poly)
+            elif self.dispStyle == 1:
+                p.drawPolyline(poly)
+            else:
+                # True blue
+                p.drawPolygon(poly)
 
     def resizeEvent(self, evt):
-        self.yy = None
-        self.xx = None
-        self.update()
+        self._invalidateEnvelope()
+        if self.gl is not None:
+            self.gl.resize(self.size())
+        self._redraw()
 
     def rebuild(self):
-        self.xx = None
-        self.yy = None
+        self._invalidateEnvelope()
         self.cc = []
         self.traces = []
         for trc in range(len(self.cfg.conn.hw)):
@@ -389,6 +704,7 @@ class ESScopeWin(QWidget):
         n = dat.shape[0]
         self.dat[:n,:] = dat
         self.write_idx = n
+        self._markDirty(0, n)
         self.dat_pre_s = self.cfg.hori.s_div * (self.cfg.trig.delay_div -
                                                 self.cfg.hori.xlim[0])
         self.dat_post_s = self.cfg.hori.s_div * (self.cfg.hori.xlim[1] -
@@ -405,9 +721,15 @@ class ESScopeWin(QWidget):
         self.dat = np.zeros((int(per_s*self.cfg.hw.acqrate.value), nch))
         self.write_idx = 0
         self.read_idx = 0
+        self.nskipped = 0
+        self.sweeppending = False
+        self.spikes = None
         if src:
             src.dataAvailable.connect(self.feedData)
             src.trigAvailable.connect(self.feedTrig)
+            self.spikes = getattr(src, 'spikes', None)
+            if self.spikes is not None:
+                self.spikes.spikesDetected.connect(self._spikesDetected)
         self.rebuild()
 
     def stopRun(self):
@@ -431,38 +753,63 @@ class ESScopeWin(QWidget):
             self.dat_post_s = self.cfg.hori.s_div * (self.cfg.hori.xlim[1] -
                                                      self.cfg.trig.delay_div)
                                                  
+        idx0 = self.write_idx
+        if self.spikes is not None:
+            self.sweep0 = self.src.read_idx - idx0
         now = self.src.getData(self.dat[self.write_idx:,:])
         if self.write_idx==0 and now > 0:
             self.sweepStarted.emit()
         self.write_idx += now
         #del lock
-        
+
+        live = self.cfg.hori.s_div > 0.1 and self.dispStyle != 3
+        if live:
+            self.disp0 = self.sweep0
+            self._markDirty(idx0, self.write_idx)
         if self.sweepIsComplete():
-            self.update()
+            if not live:
+                # Fold the whole sweep into the envelopes right away, so
+                # that the display is unaffected by the next sweep
+                # overwriting our buffer before the frame is drawn.
+                if self.sweeppending and self.dispStyle != 3:
+                    self.nskipped += 1
+                self._markDirty(0, self.write_idx)
+                self.disp0 = self.sweep0
+                if self.dispStyle == 3:
+                    self._foldPersistence()
+                else:
+                    self._updateEnvelope()
+                self.sweeppending = True
+            self._requestFrame()
             self.sweepComplete.emit()
-        elif self.cfg.hori.s_div>0.1:
-            self.update()
+        elif live:
+            # Only repaint the part of the screen affected by the new data
+            self._requestFrame(self._dirtyRect(idx0, self.write_idx))
         
     def newVertical(self, itrace):
         """Inform of changes in the vertical positioning of one trace.
 
         The actual changes must have been made to the configuration already.
         """
-        self.update()
+        self._invalidateEnvelope()
+        self._redraw()
 
     def newHorizontal(self):
         """Inform of changes in horizontal positioning of all traces.
 
         The actual changes must have been made to the configuration already.
         """
-        self.update()
+        self._invalidateEnvelope()
+        self._redraw()
 
     
 if __name__ == '__main__':
     if True:
         xx = np.random.rand(1000,1)
+        kk = np.floor(np.arange(21) * 1000/20).astype(int)
         ymin = np.zeros(20)
-        trueblue(xx, 0, ymin)
+        ymax = np.zeros(20)
+        envelope(xx, 0, kk, 0, 20, ymin, ymax)
 
     app = QApplication(sys.argv)
     cfg = esconfig.basicconfig()
@@ -0,0 +1,129 @@
+# esspikestage.py - This file is part of EScope/ESpark
+# (C) 2024  Daniel A. Wagenaar
+#
+# EScope and ESpark are free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# EScope and ESpark are distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+
+
+# esspikestage.py - live spike detection during acquisition
+
+from PyQt5.QtCore import *
+import numpy as np
+from .. import spikex
+
+
+class ESSpikeStage(QObject):
+    """Spike detection on data as they are acquired
+
+    An ESSpikeStage is fed every block of data that arrives in an
+    ESTriggerBuffer, whether or not it ends up being displayed. It
+    runs a SpikeDetector on each of the selected columns, with a
+    threshold that follows a RunningNoise estimate, and keeps a ring
+    of recent spike times for each.
+
+    COLUMNS are columns of the data blocks; CHANS are the corresponding
+    channel numbers, used only for display. Spike times are counted in
+    scans since the start of the run, as are the indices in the
+    ESTriggerBuffer.
+    """
+
+    spikesDetected = pyqtSignal(object) # Times of new spikes (any column)
+    ratesChanged = pyqtSignal()
+
+    def __init__(self, cfg, columns, chans=None, ringsize=4096):
+        super().__init__()
+        self.cfg = cfg
+        self.columns = list(columns)
+        self.chans = self.columns if chans is None else list(chans)
+        self.fs = self.cfg.hw.acqrate.value
+        self.mult = self.cfg.spikes.noise_mult
+        self.window_s = self.cfg.spikes.window_s
+        tkill = max(1, int(0.001 * self.fs))
+        chunk = max(10, int(0.005 * self.fs))
+        self.noise = [spikex.RunningNoise(chunk) for c in self.columns]
+        self.detectors = [spikex.SpikeDetector(np.nan, tkill=tkill)
+                          for c in self.columns]
+        self.ring = np.zeros((len(self.columns), ringsize), dtype=np.int64)
+        self.counts = np.zeros(len(self.columns), dtype=np.int64)
+        self.nscans = 0
+        self.nextrate = 0 # Scan count at which to next emit ratesChanged
+
+    def feed(self, blk):
+        """Process a block of data, one row per scan"""
+        R = self.ring.shape[1]
+        new = []
+        for k, col in enumerate(self.columns):
+            yy = blk[:, col]
+            thr = self.mult * self.noise[k].feed(yy)
+            spk = self.detectors[k].feed(yy, thr)
+            if len(spk):
+                new.append(spk)
+                n = self.counts[k]
+                self.counts[k] += len(spk)
+                if len(spk) > R:
+                    n += len(spk) - R
+                    spk = spk[-R:]
+                self.ring[k, (n + np.arange(len(spk))) % R] = spk
+        self.nscans += len(blk)
+        if new:
+            self.spikesDetected.emit(np.concatenate(new))
+        if self.nscans >= self.nextrate:
+            self.nextrate = self.nscans + int(0.1 * self.fs)
+            self.ratesChanged.emit()
+
+    def spikes(self, k, t0=0, t1=None):
+        """Recent spike times on the K-th column
+
+        Only spikes that are still in the ring are returned, restricted
+        to the range T0 up to T1 if given.
+        """
+        n = min(self.counts[k], self.ring.shape[1])
+        spk = np.sort(self.ring[k, :n])
+        i0 = np.searchsorted(spk, t0)
+        i1 = len(spk) if t1 is None else np.searchsorted(spk, t1)
+        return spk[i0:i1]
+
+    def rates(self):
+        """Firing rates (in Hz) over the most recent window on each column"""
+        window = int(self.window_s * self.fs)
+        t0 = self.nscans - window
+        dt = min(self.nscans, window) / self.fs
+        if dt <= 0:
+            return np.zeros(len(self.columns))
+        return np.array([len(self.spikes(k, t0))
+                         for k in range(len(self.columns))]) / dt
+
+
+if __name__ == "__main__":
+    import time
+    from . import esconfig
+    # Check that detection fits in the time budget at 8 channels at
+    # 50 kHz, fed in blocks of 10 ms.
+    cfg = esconfig.basicconfig()
+    cfg.hw.acqrate.value = 50000
+    C = 8
+    blk = int(0.01 * cfg.hw.acqrate.value)
+    T = 100 * blk
+    rng = np.random.default_rng(0)
+    dat = rng.standard_normal((T, C))
+    dat[rng.random((T, C)) < 0.0005] += 20
+    stage = ESSpikeStage(cfg, range(C))
+    for k in range(0, 20*blk, blk):
+        stage.feed(dat[k:k+blk]) # Compile, if needed
+    stage = ESSpikeStage(cfg, range(C))
+    t0 = time.time()
+    for k in range(0, T, blk):
+        stage.feed(dat[k:k+blk])
+    dt = time.time() - t0
+    print(f"{1e3*dt/(T/blk):.2f} ms per block of {1e3*blk/cfg.hw.acqrate.value:.0f} ms")
+    print("Rates:", stage.rates())
@@ -61,6 +61,8 @@ class ESTMarks(QWidget):
         self.data = None
         self.data0 = None
         self.datacolors = []
+        self.pix = None # Cached rendering of trigger symbol and time bar
+        self.pixkey = None # Configuration for which pix is valid
 
     def setCursors(self, tc, tc0, ttrig):
         self.tcursor = tc
@@ -74,16 +76,40 @@ class ESTMarks(QWidget):
         self.datacolors = cc
         self.update()
 
+    def _cacheKey(self):
+        return esconfig.cachekey(self.size(), self.devicePixelRatioF(),
+                                 self.cfg.hori.xlim, self.cfg.hori.s_div,
+                                 self.cfg.trig.delay_div, self.cfg.trig.enable,
+                                 self.tracking,
+                                 self.trackx if self.tracking==EST_TRIGDELAY
+                                 else None,
+                                 self.scl if self.tracking==EST_TIMESCALE
+                                 else None)
+
     def paintEvent(self, evt):
-        p = QPainter(self)
-        
         hp = self.height()
         wp = self.width() + 0.
         x0 = self.cfg.hori.xlim[0] + 0.
         x1 = self.cfg.hori.xlim[1]
         self.divp = wp / (x1-x0)
-        self._paintTriggerSymbol(p, x0, x1, wp, hp)
-        self._paintTimeBar(p, x0, x1, wp, hp)
+
+        # The trigger symbol and time bar only change with the
+        # configuration, whereas the cursors follow the mouse.
+        key = self._cacheKey()
+        if key != self.pixkey:
+            dpr = self.devicePixelRatioF()
+            self.pix = QPixmap(self.size() * dpr)
+            self.pix.setDevicePixelRatio(dpr)
+            self.pix.fill(Qt.transparent)
+            p = QPainter(self.pix)
+            p.setFont(self.font())
+            self._paintTriggerSymbol(p, x0, x1, wp, hp)
+            self._paintTimeBar(p, x0, x1, wp, hp)
+            p.end()
+            self.pixkey = key
+
+        p = QPainter(self)
+        p.drawPixmap(0, 0, self.pix)
         self._paintCursors(p, x0, x1, wp, hp)
 
     def _paintTriggerSymbol(self, p: QPainter, x0: float, x1: float, wp: int, hp: int):
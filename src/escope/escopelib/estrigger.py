@@ -42,6 +42,11 @@ class ESTrigger(QGroupBox):
         self.h_auto = QCheckBox(self)
         self.h_auto.setText("Auto")
         lay.addWidget(self.h_auto)
+        self.h_noise = QCheckBox(self)
+        self.h_noise.setText("5× noise")
+        self.h_noise.setToolTip("Keep the trigger level at five times"
+                                " the RMS noise in the source channel")
+        lay.addWidget(self.h_noise)
 
         def enable_slot():
             self.cfg.trig.enable = self.h_enable.isChecked()
@@ -55,6 +60,11 @@ class ESTrigger(QGroupBox):
             self.cfgChanged.emit()
         self.h_auto.toggled.connect(auto_slot)
 
+        def noise_slot():
+            self.cfg.trig.noise_mult = 5 if self.h_noise.isChecked() else 0
+            self.cfgChanged.emit()
+        self.h_noise.toggled.connect(noise_slot)
+
         self.hh_chan = []
         for ch in range(self.cfg.MAXCHANNELS):
             h = MyRadio(self)
@@ -80,6 +90,7 @@ class ESTrigger(QGroupBox):
     def reconfig(self):
         self.h_enable.setChecked(self.cfg.trig.enable)
         self.h_auto.setChecked(self.cfg.trig.auto)
+        self.h_noise.setChecked(bool(getattr(self.cfg.trig, 'noise_mult', 0)))
         for k in range(self.cfg.MAXCHANNELS):
             self.hh_chan[k].setChecked(self.cfg.trig.source == k)
             vis = self.cfg.conn.hw[k] is not None \
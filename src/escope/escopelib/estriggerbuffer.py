@@ -25,8 +25,8 @@ import numpy as np
 import ctypes
 from .esdatasource import ESDataSource
 from .esdatasource import ESDS_Dummy
-from .esdsnidaq import ESDS_Nidaq
-from .esdspicodaq import ESDS_Picodaq
+from .esspikestage import ESSpikeStage
+from .. import spikex
 
 
 PRIMELIM = 10 # Number of samples of continuously-below-trigger required
@@ -34,6 +34,7 @@ PRIMELIM = 10 # Number of samples of continuously-below-trigger required
 class ESTriggerBuffer(ESDataSource):
     trigAvailable = pyqtSignal()
     deviceError = pyqtSignal(str)
+    levelChanged = pyqtSignal()
     
     def __init__(self, cfg):
         super().__init__(cfg)
@@ -41,6 +42,8 @@ class ESTriggerBuffer(ESDataSource):
         self.read_idx = 0
         self.write_idx = 0
         self.capfh = None
+        self.noise = None
+        self.spikes = None # Optional ESSpikeStage
         #self.mutex = QMutex()
 
     def rethresh(self):
@@ -77,8 +80,10 @@ class ESTriggerBuffer(ESDataSource):
         if typ=='dummy':
             self.source = ESDS_Dummy(self.cfg)
         elif typ=='nidaq':
+            from .esdsnidaq import ESDS_Nidaq
             self.source = ESDS_Nidaq(self.cfg)
         elif typ=='picodaq':
+            from .esdspicodaq import ESDS_Picodaq
             self.source = ESDS_Picodaq(self.cfg, stimcfg)
         else:
             raise AttributeError('Unknown data source type')
@@ -94,8 +99,43 @@ class ESTriggerBuffer(ESDataSource):
         if self.cfg.trig.enable:
             self.nexttrigok_idx = 0
             self.trig_primed = 0
+        # Chunks of 5 ms, so the noise estimate covers the last 5 s
+        self.noise = spikex.RunningNoise(
+            max(10, int(0.005 * self.cfg.hw.acqrate.value)))
+        spk = getattr(self.cfg, 'spikes', None)
+        if spk is not None and spk.enable:
+            # Map channel numbers to columns of our buffer
+            cols = np.cumsum(~np.isnan(self.cfg.conn.hw)) - 1
+            chans = spk.channels
+            if chans is None:
+                chans = np.nonzero(~np.isnan(self.cfg.conn.hw))[0]
+            chans = [c for c in chans if not np.isnan(self.cfg.conn.hw[c])]
+            self.spikes = ESSpikeStage(self.cfg, cols[chans], chans)
+        else:
+            self.spikes = None
         self.rethresh()
 
+    def _tracknoise(self, src):
+        # Place the trigger level at a fixed multiple of the RMS noise
+        # in the trigger channel. The level is updated in the config
+        # as well, so that it shows up on the scale.
+        mult = getattr(self.cfg.trig, 'noise_mult', 0)
+        if not mult:
+            return
+        rms = self.noise.feed(src)
+        if np.isnan(rms):
+            return
+        s = self.cfg.trig.source
+        self.trig_volt = self.cfg.trig.direction * mult * rms
+        self.trig_revert = (self.trig_volt -
+                            self.cfg.trig.direction *
+                            0.2*self.cfg.vert.unit_div[s])
+        level = (self.trig_volt / self.cfg.vert.unit_div[s]
+                 + self.cfg.vert.offset_div[s])
+        if abs(level - self.cfg.trig.level_div) >= 0.01:
+            self.cfg.trig.level_div = level
+            self.levelChanged.emit()
+
     def startCapture(self, fn):
         self.capfh = open(fn + ".dat","wb")
 
@@ -187,8 +227,13 @@ class ESTriggerBuffer(ESDataSource):
             return
         
         self.write_idx += nrows
+
+        if self.spikes is not None:
+            self.spikes.feed(self.buffer[relidx:relidx+nrows])
         
         if self.cfg.trig.enable:
+            self._tracknoise(self.buffer[relidx:relidx+nrows,
+                                         self.trig_column])
             if self.trig_idx is not None:
                 self.dataAvailable.emit()
                 if self.write_idx - self.trig_idx >= self.posttrig_scans:
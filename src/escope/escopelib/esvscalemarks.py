@@ -53,9 +53,39 @@ class ESVScaleMarks(QWidget):
 
         self.tracking = None
         self.wheeling = None
+        self.pix = None # Cached rendering
+        self.pixkey = None # Configuration for which pix is valid
+
+    def _cacheKey(self):
+        trig = self.cfg.trig
+        return esconfig.cachekey(self.size(), self.devicePixelRatioF(),
+                                 self.cfg.vert.ylim, self.cfg.vert.unit_div,
+                                 self.cfg.conn.hw, self.cfg.conn.scale,
+                                 self.cfg.conn.units,
+                                 trig.enable, trig.source, trig.auto,
+                                 trig.direction, trig.level_div,
+                                 self.tracking,
+                                 self.tracky if self.tracking==ESV_TRIGLEVEL
+                                 else None,
+                                 self.scl if self.tracking not in
+                                 (None, ESV_TRIGLEVEL) else None)
 
     def paintEvent(self, evt):
+        key = self._cacheKey()
+        if key != self.pixkey:
+            dpr = self.devicePixelRatioF()
+            self.pix = QPixmap(self.size() * dpr)
+            self.pix.setDevicePixelRatio(dpr)
+            self.pix.fill(Qt.transparent)
+            p = QPainter(self.pix)
+            p.setFont(self.font())
+            self._paintMarks(p)
+            p.end()
+            self.pixkey = key
         p = QPainter(self)
+        p.drawPixmap(0, 0, self.pix)
+
+    def _paintMarks(self, p: QPainter):
         pn = p.pen()
         
         hp = self.height()
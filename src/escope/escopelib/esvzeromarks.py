@@ -41,9 +41,32 @@ class ESVZeroMarks(QWidget):
         self.rp = 1
         self.tracking = None
         self.wheeling = None
+        self.pix = None # Cached rendering
+        self.pixkey = None # Configuration for which pix is valid
+
+    def _cacheKey(self):
+        return esconfig.cachekey(self.size(), self.devicePixelRatioF(),
+                                 self.cfg.vert.ylim, self.cfg.vert.offset_div,
+                                 self.cfg.vert.coupling, self.cfg.conn.hw,
+                                 self.tracking,
+                                 self.tracky if self.tracking is not None
+                                 else None)
 
     def paintEvent(self, evt):
+        key = self._cacheKey()
+        if key != self.pixkey:
+            dpr = self.devicePixelRatioF()
+            self.pix = QPixmap(self.size() * dpr)
+            self.pix.setDevicePixelRatio(dpr)
+            self.pix.fill(Qt.transparent)
+            p = QPainter(self.pix)
+            self._paintMarks(p)
+            p.end()
+            self.pixkey = key
         p = QPainter(self)
+        p.drawPixmap(0, 0, self.pix)
+
+    def _paintMarks(self, p: QPainter):
         hp = self.height()
         wp = self.width()
         hsclp = (0.9*wp)/(self.cfg.MAXCHANNELS+1)
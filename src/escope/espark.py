@@ -11,6 +11,7 @@ import re
 import pickle
 import numpy as np
 from .escopelib import esparkwin
+from .escopelib import espgraph
 
 ######################################################################
 def main():
@@ -23,6 +24,8 @@ def main():
         os.mkdir("EScopeData")
     os.chdir("EScopeData")
     app = QApplication(sys.argv)
+    if "--matplotlib" in sys.argv[1:]:
+        espgraph.setBackend('matplotlib')
     cfg = esparkwin.espconfig.basicconfig()
     mw = esparkwin.MainWin(cfg, True)
     mw.show()
@@ -40,11 +40,13 @@ def _readurl(url: str, binary: bool = False) -> Union[str, bytes]:
                 return fd.read()
 
 
-def load(fn: str) -> Tuple[np.ndarray, dict]:
+def load(fn: str, mmap: bool = False) -> Tuple[np.ndarray, dict]:
     '''Load a recording from EScope 3.0
 
     Parameters:
         fn: Filename to load. This should be the ".escope" file.
+        mmap: If True, the data are memory-mapped rather than read
+              into memory. This is not possible for URLs.
 
     Returns:
         data - Data as a numpy array (see below)
@@ -84,14 +86,19 @@ def load(fn: str) -> Tuple[np.ndarray, dict]:
         fn = fn[:-7]
 
     info = json.loads(_readurl(fn + ".escope"))
-    data = _readurl(fn + ".dat", binary=True)
     if "config" not in info:
         info["config"] = json.loads(_readurl(fn + ".config"))
 
     if info["version"] >= "escope-3.2":
-        data = np.frombuffer(data, dtype=np.float32)
+        dtype = np.float32
     else:
-        data = np.frombuffer(data)
+        dtype = np.float64
+    if mmap:
+        if fn.startswith("http"):
+            raise ValueError("Cannot memory-map a URL")
+        data = np.memmap(fn + ".dat", dtype=dtype, mode="r")
+    else:
+        data = np.frombuffer(_readurl(fn + ".dat", binary=True), dtype=dtype)
     
     C = len(info['channels'])
     if info['config']['trig']['enable'] and info['config']["capt_enable"]:
@@ -133,7 +140,7 @@ def plot(data: np.ndarray, info: dict):
         if uni == 'V':
             uni = 'mV'
         units.append(uni)
-        factors.append(Units(scale).asunits(uni))
+        factors.append(Units(scale).factor_to(uni))
 
     hassweeps = len(data.shape) == 3
     plt.clf()
@@ -158,12 +165,13 @@ class Recording:
 
     The constructor loads data from a “.escope” file. If the name starts
     with “http://” or “https://”, the file is downloaded from the internet.
+    With *mmap* set, local data are memory-mapped rather than read.
     
     '''
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, mmap: bool = False):
         '''Load a recording from a .escope file.'''
-        self._data, self._info = load(filename)
+        self._data, self._info = load(filename, mmap)
 
     def info(self) -> dict:
         '''Information about the recording as a dictionary.
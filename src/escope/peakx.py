@@ -15,23 +15,18 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 
 
-#from numba import jit
 import numpy as np
 from typing import Optional, Tuple
 
-#@jit
-#def _schmittcore(data, thr_on, thr_off):
-#    trans = []
-#    isup = False
-#    for k in range(len(data)):
-#        if data[k]<=thr_off if isup else data[k]>=thr_on:
-#            trans.append(k)
-#            isup = not isup
-#    ion = trans[::2]
-#    ioff = trans[1::2]
-#    return ion, ioff
+try:
+    from numba import jit
+    havejit = True
+except ModuleNotFoundError:
+    havejit = False
 
-def _schmittcore(data, thr_on, thr_off):
+
+def _schmittcore_py(data, thr_on, thr_off):
+    # Reference implementation, kept for comparison
     trans = []
     isup = False
     upcros = np.diff((data >= thr_on).astype(int)) > 0
@@ -47,11 +42,73 @@ def _schmittcore(data, thr_on, thr_off):
                 trans.append(i)
                 isup = True
 
-    trans = np.array(trans) + 1      
+    trans = np.array(trans, dtype=int) + 1      
     ion = trans[::2]
     ioff = trans[1::2]
     return ion, ioff
-    
+
+
+def _schmitttrans_np(data, thr_on, thr_off, isup=False):
+    # Rather than walking through the candidate crossings one by one,
+    # we note that the state after an upward crossing is always “up”
+    # and after a downward crossing always “down”. Only a candidate that
+    # is both (possible if thr_off ≥ thr_on) toggles the state, so we
+    # forward-fill the state from the last unambiguous crossing and
+    # count the toggles since.
+    upcros = np.diff((data >= thr_on).astype(np.int8)) > 0
+    dncros = np.diff((data <= thr_off).astype(np.int8)) > 0
+    anyi = np.nonzero(upcros | dncros)[0]
+    state = upcros[anyi]
+    both = state & dncros[anyi]
+    if np.any(both):
+        idx = np.arange(len(anyi))
+        last = np.maximum.accumulate(np.where(both, -1, idx))
+        ntoggle = np.cumsum(both)
+        base = np.where(last >= 0, state[last], isup)
+        since = ntoggle - np.where(last >= 0, ntoggle[last], 0)
+        state = base ^ (since % 2 == 1)
+    wasup = np.concatenate(([isup], state[:-1]))
+    trans = anyi[state != wasup] + 1
+    if len(state):
+        isup = bool(state[-1])
+    return trans, isup
+
+
+def _schmittcore_np(data, thr_on, thr_off):
+    trans, _ = _schmitttrans_np(data, thr_on, thr_off)
+    return trans[::2], trans[1::2]
+
+
+if havejit:
+    @jit(nopython=True, nogil=True)
+    def _schmitttrans_jit(data, thr_on, thr_off, isup):
+        trans = np.empty(len(data), np.int64)
+        ntrans = 0
+        for k in range(len(data) - 1):
+            if isup:
+                if data[k+1] <= thr_off and not data[k] <= thr_off:
+                    trans[ntrans] = k + 1
+                    ntrans += 1
+                    isup = False
+            else:
+                if data[k+1] >= thr_on and not data[k] >= thr_on:
+                    trans[ntrans] = k + 1
+                    ntrans += 1
+                    isup = True
+        return trans[:ntrans], isup
+
+    def _schmitttrans(data, thr_on, thr_off, isup=False):
+        if data.dtype == bool:
+            data = data.view(np.uint8)
+        return _schmitttrans_jit(data, thr_on, thr_off, isup)
+else:
+    _schmitttrans = _schmitttrans_np
+
+
+def _schmittcore(data, thr_on, thr_off):
+    trans, _ = _schmitttrans(data, thr_on, thr_off)
+    return trans[::2], trans[1::2]
+
 
 class STARTTYPE:
     DROP_PARTIAL = 0
@@ -136,7 +193,7 @@ def schmitt(data: np.ndarray,
         pass # There may be an extra up transition
     elif endtype==2:
         if len(iup)>len(idn):
-            idn.append(len(data))
+            idn = np.append(idn, len(data))
     else:
         raise ValueError('Invalid end type')
     
@@ -208,7 +265,56 @@ def schmitt2(data: np.array, thr_a: float, thr_b: float) \
     return on_a, off_a, on_b, off_b
 
 
-def schmittpeak(data: np.array, iup: np.array, idn: np.array) -> np.array:
+def _schmittpeak_py(data, iup, idn):
+    # Reference implementation, kept for comparison
+    ipk = np.zeros(iup.shape, dtype=iup.dtype)
+    for k in range(len(iup)):
+        ipk[k] = iup[k]+ np.argmax(data[iup[k]:idn[k]])
+    return ipk
+
+
+def _schmittpeak_np(data, iup, idn):
+    # We gather all the samples inside the peaks into one vector, find
+    # the maximum of each peak with reduceat, and then recover the
+    # first position in each peak where that maximum is attained.
+    lens = idn - iup
+    if np.any(lens <= 0):
+        raise ValueError('Empty peak')
+    if len(lens) == 0:
+        return np.zeros(iup.shape, dtype=iup.dtype)
+    starts = np.cumsum(lens) - lens
+    idx = np.repeat(iup - starts, lens) + np.arange(starts[-1] + lens[-1])
+    vals = data[idx]
+    hei = np.repeat(np.maximum.reduceat(vals, starts), lens)
+    hits = vals == hei
+    if vals.dtype.kind == 'f':
+        hits |= np.isnan(hei) & np.isnan(vals) # argmax prefers NaN
+    hitk = np.nonzero(hits)[0]
+    seg = np.searchsorted(starts, hitk, 'right')
+    first = np.concatenate(([True], seg[1:] != seg[:-1]))
+    return idx[hitk[first]].astype(iup.dtype)
+
+
+if havejit:
+    @jit(nopython=True, nogil=True)
+    def _schmittpeak_jit(data, iup, idn, ipk):
+        for k in range(len(iup)):
+            if idn[k] <= iup[k]:
+                raise ValueError('Empty peak')
+            ipk[k] = iup[k] + np.argmax(data[iup[k]:idn[k]])
+
+    def _schmittpeak(data, iup, idn):
+        if data.dtype == bool:
+            data = data.view(np.uint8)
+        ipk = np.zeros(iup.shape, dtype=iup.dtype)
+        _schmittpeak_jit(data, iup, idn, ipk)
+        return ipk
+else:
+    _schmittpeak = _schmittpeak_np
+
+
+def schmittpeak(data: np.array, iup: np.array, idn: np.array,
+                details: bool = False):
     '''Find peaks in data after Schmitt triggering
 
     Arguments
@@ -225,6 +331,8 @@ def schmittpeak(data: np.array, iup: np.array, idn: np.array) -> np.array:
         The indices where DATA crosses down through *thr_off* coming from
         above *thr_on*, as returned by a previous call to *schmitt*
 
+    details (optional)
+        If True, also return the heights and widths of the peaks.
 
     Returns
     -------
@@ -232,6 +340,10 @@ def schmittpeak(data: np.array, iup: np.array, idn: np.array) -> np.array:
     Indices of peaks between pairs of upward and downward threshold
     crossings.
 
+    If *details* is True, returns a tuple (ipk, height, width), where
+    *height* is the value of DATA at each peak and *width* is the
+    number of samples between the upward and downward crossings.
+
     Notes
     -----
 
@@ -239,11 +351,16 @@ def schmittpeak(data: np.array, iup: np.array, idn: np.array) -> np.array:
     using *starttype* = STARTTYPE.DROP_PARTIAL and/or
     *endtype* = ENDTYPE.DROP_PARTIAL when calling *schmitt*.
 
+    All peaks are processed in a single pass, either by a numba
+    kernel or, if numba is not available, by vectorized NumPy code.
+
     '''
 
-    ipk = np.zeros(iup.shape, dtype=iup.dtype)
-    for k in range(len(iup)):
-        ipk[k] = iup[k]+ np.argmax(data[iup[k]:idn[k]])
+    iup = np.asarray(iup)
+    idn = np.asarray(idn)
+    ipk = _schmittpeak(data, iup, idn)
+    if details:
+        return ipk, data[ipk], idn - iup
     return ipk
 
 
@@ -263,3 +380,57 @@ if __name__=='__main__':
     print(f'idnb = {idnb}')
     ipk = schmittpeak(data, iupa, idna)
     print(f'ipk = {ipk}')
+
+    # Compare implementations of the core, including the odd case
+    # where the thresholds are reversed
+    import time
+    cores = [_schmittcore_py, _schmittcore_np]
+    if havejit:
+        cores.append(_schmittcore)
+    rng = np.random.default_rng(1)
+    for trial in range(200):
+        data = rng.standard_normal(rng.integers(0, 300)).cumsum()
+        if trial % 3 == 1:
+            data = np.round(data)
+        elif trial % 3 == 2:
+            data[rng.random(len(data)) < .05] = np.nan
+        thr_on, thr_off = rng.standard_normal(2)
+        ref = _schmittcore_py(data, thr_on, thr_off)
+        for core in cores[1:]:
+            res = core(data, thr_on, thr_off)
+            assert np.array_equal(res[0], ref[0])
+            assert np.array_equal(res[1], ref[1])
+    data = rng.random(300) > .5
+    assert all(np.array_equal(core(data, True, False)[0],
+                              _schmittcore_py(data, True, False)[0])
+               for core in cores)
+    print('Schmitt cores agree')
+
+    peakers = [_schmittpeak_py, _schmittpeak_np]
+    if havejit:
+        peakers.append(_schmittpeak)
+    for trial in range(200):
+        data = rng.standard_normal(rng.integers(2, 300))
+        if trial % 3 == 1:
+            data = np.round(data) # Ties
+        elif trial % 3 == 2:
+            data[rng.random(len(data)) < .05] = np.nan
+        iup, idn = schmitt(data, .5, -.5, ENDTYPE.INCLUDE_PARTIAL)
+        ref = _schmittpeak_py(data, iup, idn)
+        for peaker in peakers[1:]:
+            assert np.array_equal(peaker(data, iup, idn), ref)
+    print('Peak finders agree')
+
+    data = rng.standard_normal(10_000_000)
+    for core in cores:
+        core(data[:100], 1, -1) # Compile, if needed
+        t0 = time.time()
+        core(data, 1, -1)
+        print(f'{core.__name__}: {time.time() - t0:.3f} s')
+    iup, idn = schmitt(data, 1, -1)
+    for peaker in peakers:
+        peaker(data, iup[:10], idn[:10]) # Compile, if needed
+        t0 = time.time()
+        peaker(data, iup, idn)
+        print(f'{peaker.__name__}: {time.time() - t0:.3f} s'
+              + f' for {len(iup)} peaks')
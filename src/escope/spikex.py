@@ -16,20 +16,98 @@
 
 
 import numpy as np
+import math
+import os
+import statistics
 from typing import List, Optional
 
 from . import peakx
 
+try:
+    from numba import jit
+    havejit = True
+except ModuleNotFoundError:
+    havejit = False
+
 
-_corrfac = {}
 def _estimatemuckfactor(chunksize, nchunks=1000, ipart=25):
-    myid = (chunksize, nchunks, ipart)
-    if myid in _corrfac:
-        return _corrfac[myid]
+    # Monte Carlo reference, kept for comparison
     dat = np.reshape(np.random.randn(chunksize*nchunks), (chunksize, nchunks))
     rms = np.std(dat, 0)
     K = int(ipart * nchunks / 100 + 0.5)
     est = np.partition(rms, K)[K]
+    return est
+
+
+def _gammainc(a, x):
+    # Regularized lower incomplete gamma function P(a, x), by series
+    # for small x and by continued fraction for large x
+    if x <= 0:
+        return 0.0
+    lpre = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = 1 / a
+        tot = term
+        n = 0
+        while abs(term) > 1e-15 * abs(tot):
+            n += 1
+            term *= x / (a + n)
+            tot += term
+        return tot * math.exp(lpre)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    n = 0
+    while True:
+        n += 1
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return 1 - math.exp(lpre) * h
+
+
+def _chi2quantile(p, k):
+    # Quantile of the chi-squared distribution with K degrees of
+    # freedom. The Wilson-Hilferty approximation serves as a starting
+    # point for Newton iteration on the exact CDF.
+    z = statistics.NormalDist().inv_cdf(p)
+    x = k * max(1 - 2/(9*k) + z * math.sqrt(2/(9*k)), 1e-3)**3
+    lnorm = (k/2) * math.log(2) + math.lgamma(k/2)
+    for _ in range(100):
+        pdf = math.exp((k/2 - 1) * math.log(x) - x/2 - lnorm)
+        dx = (_gammainc(k/2, x/2) - p) / pdf
+        x = max(x - dx, x/10)
+        if abs(dx) < 1e-12 * x:
+            break
+    return x
+
+
+_corrfac = {}
+def _muckfactor(chunksize, nchunks=1000, ipart=25):
+    # The typical value of the order statistic that rmsnoise picks
+    # from the chunk RMS values of unit Gaussian noise. For each chunk,
+    # chunksize · std² follows a chi-squared distribution with
+    # chunksize - 1 degrees of freedom. The K-th smallest of nchunks
+    # values is approximated by the quantile at (K + 0.7)/(nchunks + 0.4)
+    # (Benard's median rank), which tends to IPART % for many chunks.
+    if chunksize < 2:
+        raise ValueError(f"Chunk size must be at least 2, not {chunksize}")
+    myid = (chunksize, nchunks, ipart)
+    if myid in _corrfac:
+        return _corrfac[myid]
+    K = int(ipart * nchunks / 100 + 0.5)
+    p = (K + 0.7) / (nchunks + 0.4)
+    est = math.sqrt(_chi2quantile(p, chunksize - 1) / chunksize)
     _corrfac[myid] = est
     return est
 
@@ -48,6 +126,7 @@ def rmsnoise(dat: np.ndarray[float],
     chunksize (optional)
         The number of samples per chunk. Reasonable values are
         whatever corresponds to 5 or 10 ms at your sampling rate.
+        Must be at least 2.
 
     percentile (optional)
         The percentile at which to sample the chunks. Usually, the
@@ -78,7 +157,7 @@ def rmsnoise(dat: np.ndarray[float],
     chunksize = int(chunksize)
     L = len(dat)
     N = L // chunksize # number of chunks
-    cf = _estimatemuckfactor(chunksize, N, percentile)
+    cf = _muckfactor(chunksize, N, percentile)
     dat = np.reshape(dat[:N*chunksize], [N, chunksize])
     rms = np.std(dat, 1)
     K = int(percentile*N/100 + 0.5)
@@ -86,6 +165,145 @@ def rmsnoise(dat: np.ndarray[float],
     return est / cf
 
 
+class RunningNoise:
+    """Estimated RMS noise in data that arrive in blocks
+
+    Parameters *chunksize* and *percentile* are as for *rmsnoise*.
+    The RMS values of the most recent *nchunks* chunks are retained,
+    so that the estimate follows slow drift in the noise level while
+    memory use remains fixed. As long as fewer than *nchunks* chunks
+    have been seen, the estimate equals what *rmsnoise* would return
+    on the concatenated data.
+
+    Example::
+
+        noise = RunningNoise()
+        det = None
+        spks = []
+        for blk in blocks:
+            thr = 5 * noise.feed(blk)
+            if det is None:
+                det = SpikeDetector(thr)
+            spks.append(det.feed(blk, thr))
+
+    """
+
+    def __init__(self, chunksize: int = 300,
+                 nchunks: int = 1000,
+                 percentile: int = 25):
+        if int(chunksize) < 2:
+            raise ValueError(f"Chunk size must be at least 2, not {chunksize}")
+        self.chunksize = int(chunksize)
+        self.percentile = percentile
+        self.rms = np.zeros(nchunks) # Ring buffer of chunk RMS values
+        self.n = 0 # Number of chunks seen so far
+        self.partial = np.zeros(self.chunksize) # Incomplete last chunk
+        self.npartial = 0
+
+    def feed(self, yy: np.ndarray[float]) -> float:
+        """Process the next block of data
+
+        Returns the updated estimate, or NaN if not even one chunk has
+        been seen yet.
+        """
+        C = self.chunksize
+        if self.npartial:
+            k = min(C - self.npartial, len(yy))
+            self.partial[self.npartial:self.npartial + k] = yy[:k]
+            self.npartial += k
+            yy = yy[k:]
+            if self.npartial == C:
+                self._store(np.std(self.partial).reshape(1))
+                self.npartial = 0
+        N = len(yy) // C
+        if N:
+            self._store(np.std(np.reshape(yy[:N*C], [N, C]), 1))
+        rest = len(yy) - N*C
+        if rest:
+            self.partial[:rest] = yy[N*C:]
+            self.npartial = rest
+        return self.value()
+
+    def _store(self, rms):
+        M = len(self.rms)
+        if len(rms) > M:
+            self.n += len(rms) - M
+            rms = rms[-M:]
+        self.rms[(self.n + np.arange(len(rms))) % M] = rms
+        self.n += len(rms)
+
+    def value(self) -> float:
+        """The current estimate"""
+        N = min(self.n, len(self.rms))
+        if N == 0:
+            return np.nan
+        cf = _muckfactor(self.chunksize, N, self.percentile)
+        K = int(self.percentile*N/100 + 0.5)
+        est = np.partition(self.rms[:N], K)[K]
+        return est / cf
+
+
+def _droptoonear_py(ipk, hei, tkill):
+    # Reference implementation, kept for comparison.
+    # Drops minor peaks that are within TKILL of major ones. HEI is
+    # modified. Returns the surviving peaks and their heights.
+    done = False
+    while not done:
+        done = True
+        for k in range(len(ipk) - 1):
+            if ipk[k+1] - ipk[k] < tkill:
+                done = False
+                if hei[k] < hei[k+1]:
+                    hei[k] = 0
+                else:
+                    hei[k+1] = 0
+        idx = np.nonzero(hei)
+        ipk = ipk[idx]
+        hei = hei[idx]
+    return ipk, hei
+
+
+def _droptoonear_np(ipk, hei, tkill):
+    # Each pass of the reference loop is done in one go. At each close
+    # pair, the loop compares the left peak (which may just have been
+    # zeroed by the previous pair) against the right one. Whether the
+    # left peak was zeroed follows a little recurrence, z[k+1] =
+    # f_k(z[k]), where each f_k is either a constant, the identity, or
+    # negation. That is solved by forward-filling from the last
+    # constant and counting negations, as in peakx._schmitttrans.
+    # Each pass at least halves every run of close peaks, so there are
+    # only logarithmically many passes.
+    while True:
+        close = np.diff(ipk) < tkill
+        if not np.any(close):
+            keep = hei != 0
+            return ipk[keep], hei[keep]
+        h1 = hei[1:]
+        zapfresh = close & ~(hei[:-1] < h1) # Zap right peak if left is intact
+        zapzero = close & ~(0 < h1) # Zap right peak if left was zapped
+        fixed = np.concatenate(([True], zapfresh == zapzero))
+        value = np.concatenate(([False], zapfresh))
+        flip = np.concatenate(([False], zapfresh & ~zapzero))
+        idx = np.arange(len(ipk))
+        last = np.maximum.accumulate(np.where(fixed, idx, 0))
+        nflip = np.cumsum(flip)
+        zapped = value[last] ^ ((nflip - nflip[last]) % 2 == 1)
+        left = np.where(zapped[:-1], 0, hei[:-1])
+        zapped[:-1] |= close & (left < h1)
+        keep = ~zapped & (hei != 0)
+        ipk = ipk[keep]
+        hei = hei[keep]
+
+
+if havejit:
+    _droptoonear_jit = jit(nopython=True, nogil=True)(_droptoonear_py)
+
+    def _droptoonear(ipk, hei, tkill):
+        return _droptoonear_jit(ipk, hei, tkill)
+else:
+    _droptoonear = _droptoonear_np
+
+
 def detectspikes(yy: np.ndarray[float],
                  threshold: float,
                  polarity: int = 0,
@@ -131,36 +349,20 @@ def detectspikes(yy: np.ndarray[float],
 
     """
 
-    def droptoonear(ipk, hei, tkill):
-        done = False
-        while not done:
-            done = True
-            for k in range(len(ipk) - 1):
-                if ipk[k+1] - ipk[k] < tkill:
-                    done = False
-                    if hei[k] < hei[k+1]:
-                        hei[k] = 0
-                    else:
-                        hei[k+1] = 0
-            idx = np.nonzero(hei)
-            ipk = ipk[idx]
-            hei = hei[idx]
-        return ipk
-            
     if polarity >= 0:
         iup, idn = peakx.schmitt(yy, threshold, 0)
-        ipk = peakx.schmittpeak(yy, iup, idn)
+        ipk, hei, _ = peakx.schmittpeak(yy, iup, idn, details=True)
         if tkill is not None:
-            ipk = droptoonear(ipk, yy[ipk], tkill)
+            ipk, _ = _droptoonear(ipk, hei, tkill)
     else:
         ipk = None   
 
     if polarity <= 0:
         zz = -yy
         iup, idn = peakx.schmitt(zz, threshold, 0)
-        itr = peakx.schmittpeak(zz, iup, idn)
+        itr, hei, _ = peakx.schmittpeak(zz, iup, idn, details=True)
         if tkill is not None:
-            itr = droptoonear(itr, zz[itr], tkill)
+            itr, _ = _droptoonear(itr, hei, tkill)
     else:
         itr = None
 
@@ -176,12 +378,238 @@ def detectspikes(yy: np.ndarray[float],
 
     return res
 
+
+class _PeakStream:
+    """Schmitt triggering and peak finding of one polarity across blocks
+
+    This carries the state of the Schmitt trigger, the running maximum
+    of a peak that straddles a block boundary, and peaks that may still
+    be dropped by later ones within *tkill*.
+    """
+    def __init__(self, threshold, tkill):
+        self.threshold = threshold
+        self.tkill = tkill
+        self.n = 0 # Number of samples seen so far
+        self.last = None # Last sample of the previous block
+        self.isup = False
+        self.bestidx = None # Running peak of an unfinished up state
+        self.bestval = None
+        self.ipk = np.zeros(0, dtype=int) # Peaks not yet final
+        self.hei = np.zeros(0)
+
+    def _extend(self, x, i0, i1):
+        # Fold samples I0 up to I1 (counted from the start of the
+        # stream) of the current block X into the running peak,
+        # preferring earlier samples and NaNs, as np.argmax does.
+        if i1 <= i0:
+            return
+        seg = x[i0 - self.n : i1 - self.n]
+        k = np.argmax(seg)
+        v = seg[k]
+        if (self.bestidx is None or v > self.bestval
+                or (np.isnan(v) and not np.isnan(self.bestval))):
+            self.bestidx = i0 + k
+            self.bestval = v
+
+    def feed(self, x):
+        """Process the next block
+
+        Returns the indices and heights of peaks that are now final,
+        and the index before which no further peaks will be reported.
+        """
+        if len(x) == 0:
+            return self._finalize(self.bestidx if self.isup else self.n)
+        if self.last is None:
+            xx = x
+            off = 0
+        else:
+            xx = np.concatenate(([self.last], x))
+            off = self.n - 1
+        trans, isup = peakx._schmitttrans(xx, self.threshold, 0, self.isup)
+        trans = trans + off
+        iend = self.n + len(x)
+        ipk = []
+        hei = []
+        if self.isup:
+            if len(trans):
+                # The peak that was in progress is now complete
+                self._extend(x, self.n, trans[0])
+                ipk.append([self.bestidx])
+                hei.append([self.bestval])
+                trans = trans[1:]
+            else:
+                self._extend(x, self.n, iend)
+        iup = trans[::2]
+        idn = trans[1::2]
+        if len(idn):
+            ipk1, hei1, _ = peakx.schmittpeak(xx, iup[:len(idn)] - off,
+                                              idn - off, details=True)
+            ipk.append(ipk1 + off)
+            hei.append(hei1)
+        if len(iup) > len(idn):
+            # A peak starts in this block but does not end
+            self.bestidx = None
+            self._extend(x, iup[-1], iend)
+        self.isup = isup
+        self.last = x[-1]
+        self.n = iend
+        if ipk:
+            self.ipk = np.concatenate([self.ipk] + ipk).astype(int)
+            self.hei = np.concatenate([self.hei] + hei)
+        return self._finalize(self.bestidx if self.isup else self.n)
+
+    def finish(self):
+        """Process the end of the stream
+
+        A peak that is still in progress is completed, as in *schmitt*
+        with *endtype* = ENDTYPE.INCLUDE_PARTIAL.
+        """
+        if self.isup:
+            self.ipk = np.append(self.ipk, self.bestidx)
+            self.hei = np.append(self.hei, self.bestval)
+            self.isup = False
+        return self._finalize(None)
+
+    def _finalize(self, horizon):
+        # Clusters of peaks separated by at least TKILL do not interact
+        # in _droptoonear, so any cluster that cannot be joined by
+        # future peaks (which will come at or after HORIZON) is final.
+        ipk = self.ipk
+        if self.tkill is None or horizon is None:
+            nfinal = len(ipk)
+        elif len(ipk) == 0:
+            nfinal = 0
+        elif horizon - ipk[-1] >= self.tkill:
+            nfinal = len(ipk)
+        else:
+            brk = np.nonzero(np.diff(ipk) >= self.tkill)[0]
+            nfinal = brk[-1] + 1 if len(brk) else 0
+        fin = ipk[:nfinal]
+        hei = self.hei[:nfinal]
+        self.ipk = ipk[nfinal:]
+        self.hei = self.hei[nfinal:]
+        if self.tkill is not None:
+            fin, hei = _droptoonear(fin, hei.copy(), self.tkill)
+        if nfinal < len(ipk):
+            horizon = ipk[nfinal]
+        return fin, hei, horizon
+
+
+class SpikeDetector:
+    """Spike detection on data that arrive in blocks
+
+    Parameters are as for *detectspikes*. Feed consecutive blocks of
+    data to *feed*, which returns the spikes that can be determined
+    with certainty so far. When the data end, call *finish* to obtain
+    the remainder. Together, those return exactly what *detectspikes*
+    would have returned on the concatenated data, with indices counted
+    from the start of the first block.
+
+    Example::
+
+        det = SpikeDetector(5 * rmsnoise(yy[:100000]))
+        spks = []
+        for blk in blocks:
+            spks.append(det.feed(blk))
+        spks.append(det.finish())
+        spks = np.concatenate(spks)
+
+    """
+
+    def __init__(self, threshold: float,
+                 polarity: int = 0,
+                 tkill: int = 50,
+                 upperthresh: Optional[float] = None):
+        self.streams = []
+        if polarity >= 0:
+            self.streams.append((1, _PeakStream(threshold, tkill)))
+        if polarity <= 0:
+            self.streams.append((-1, _PeakStream(threshold, tkill)))
+        self.upperthresh = upperthresh
+        self.ipk = np.zeros(0, dtype=int) # Final, but not yet reported
+        self.hei = np.zeros(0)
+
+    def feed(self, yy: np.ndarray[float],
+             threshold: Optional[float] = None) -> np.ndarray[int]:
+        """Process the next block of data
+
+        If *threshold* is given, it replaces the detection threshold
+        from this block onward, e.g., to follow a *RunningNoise*
+        estimate.
+
+        Returns indices of newly detected spikes.
+        """
+        if threshold is not None:
+            for sgn, strm in self.streams:
+                strm.threshold = threshold
+        return self._report([strm.feed(yy if sgn > 0 else -yy)
+                             for sgn, strm in self.streams])
+
+    def finish(self) -> np.ndarray[int]:
+        """Process the end of the data
+
+        Returns indices of any remaining spikes.
+        """
+        return self._report([strm.finish() for sgn, strm in self.streams])
+
+    def _report(self, results):
+        # Spikes of one polarity can only be reported once we know
+        # that no spikes of the other polarity will precede them.
+        horizon = None
+        for ipk, hei, hor in results:
+            self.ipk = np.append(self.ipk, ipk)
+            self.hei = np.append(self.hei, hei)
+            if hor is not None and (horizon is None or hor < horizon):
+                horizon = hor
+        order = np.argsort(self.ipk, kind='stable')
+        ipk = self.ipk[order]
+        hei = self.hei[order]
+        n = len(ipk) if horizon is None else np.searchsorted(ipk, horizon)
+        self.ipk = ipk[n:]
+        self.hei = hei[n:]
+        ipk = ipk[:n]
+        if self.upperthresh is not None:
+            ipk = ipk[np.abs(hei[:n]) < self.upperthresh]
+        return ipk
+
     
+def _cleancontext_py(idx, dat, test, testabs, thr, absthr):
+    # Reference implementation, kept for comparison
+    keep = np.zeros(idx.shape, dtype=idx.dtype)
+    if type(test)==list:
+        test = np.concatenate(test)
+    if type(testabs)==list:
+        testabs = np.concatenate(testabs)
+    t0 = np.min([np.min(test), np.min(testabs)])
+    t1 = np.max([np.max(test), np.max(testabs)])
+    T = len(dat)
+    hei = dat[idx]
+    pol = np.sign(hei)
+    for k in range(len(idx)):
+        t = idx[k]
+        if t + t0 < 0 or t + t1 >= T:
+            continue
+        if thr is not None:
+            if pol[k]>0:
+                if any(dat[t + test] > thr*hei[k]):
+                    continue
+            else:
+                if any(dat[t + test] < thr*hei[k]):
+                    continue
+        if absthr is not None:
+            if any(np.abs(dat[t + testabs]) > absthr*np.abs(hei[k])):
+                continue
+        keep[k] = t
+    return keep[keep > 0]
+
+
 def cleancontext(idx: np.ndarray[int], dat: np.ndarray[float],
                  test: List[range] = [range(-25, -12), range(12, 25)],
                  testabs: List[range] = [range(-25, -4), range(4, 25)],
                  thr: float = 0.50,
-                 absthr: float = 0.90) -> np.ndarray[int]:
+                 absthr: float = 0.90,
+                 waveforms: bool = False,
+                 blocksize: int = 4096):
     '''CLEANCONTEXT - Drop spikes if their context is not clean
     idx = CLEANCONTEXT(idx, dat) treats the spikes at IDX (from DETECTSPIKES
     run on DAT) to the classic filtering operation in MEABench. That is,
@@ -198,31 +626,450 @@ def cleancontext(idx: np.ndarray[int], dat: np.ndarray[float],
     Set THR or ABSTHR to None to avoid the corresponding test.
 
     Spikes too near the start or end of the recording are dropped 
-    unconditionally.'''
+    unconditionally.
+
+    idx, wav = CLEANCONTEXT(..., waveforms=True) also returns the
+    context of the surviving spikes as an NxW array, where W spans the
+    earliest to the latest sample tested. Column j corresponds to an
+    offset of j + min(TEST, TESTABS) samples from the peak.
+
+    Spikes are processed in blocks of BLOCKSIZE to limit memory use.'''
 
-    keep = np.zeros(idx.shape, dtype=idx.dtype)
     if type(test)==list:
         test = np.concatenate(test)
     if type(testabs)==list:
         testabs = np.concatenate(testabs)
-    t0 = np.min([np.min(test), np.min(testabs)])
-    t1 = np.max([np.max(test), np.max(testabs)])
+    test = np.asarray(test, dtype=int)
+    testabs = np.asarray(testabs, dtype=int)
+    t0 = min(np.min(test), np.min(testabs))
+    t1 = max(np.max(test), np.max(testabs))
+    offsets = np.arange(t0, t1 + 1)
     T = len(dat)
-    hei = dat[idx]
-    pol = np.sign(hei)
-    for k in range(len(idx)):
-        t = idx[k]
-        if t + t0 < 0 or t + t1 >= T:
-            continue
+    idx = np.asarray(idx)
+    ok = (idx + t0 >= 0) & (idx + t1 < T) & (idx > 0)
+    keep = []
+    wavs = []
+    for b0 in range(0, len(idx), blocksize):
+        tt = idx[b0:b0+blocksize][ok[b0:b0+blocksize]]
+        wav = dat[tt.reshape(-1, 1) + offsets]
+        hei = dat[tt]
+        clean = np.ones(len(tt), dtype=bool)
         if thr is not None:
-            if pol[k]>0:
-                if any(dat[t + test] > thr*hei[k]):
-                    continue
-            else:
-                if any(dat[t + test] < thr*hei[k]):
-                    continue
+            ctx = wav[:, test - t0]
+            lim = (thr*hei).reshape(-1, 1)
+            clean &= np.where(hei > 0,
+                              ~np.any(ctx > lim, 1),
+                              ~np.any(ctx < lim, 1))
         if absthr is not None:
-            if any(np.abs(dat[t + testabs]) > absthr*np.abs(hei[k])):
-                continue
-        keep[k] = t
-    return keep[keep > 0]
+            ctx = np.abs(wav[:, testabs - t0])
+            lim = (absthr*np.abs(hei)).reshape(-1, 1)
+            clean &= ~np.any(ctx > lim, 1)
+        keep.append(tt[clean])
+        if waveforms:
+            wavs.append(wav[clean])
+    if keep:
+        keep = np.concatenate(keep)
+    else:
+        keep = np.zeros(0, dtype=idx.dtype)
+    if waveforms:
+        if wavs:
+            wavs = np.concatenate(wavs)
+        else:
+            wavs = np.zeros((0, len(offsets)), dtype=dat.dtype)
+        return keep, wavs
+    return keep
+
+
+SPIKE_DTYPE = np.dtype([('channel', np.int16),
+                        ('sweep', np.int32),
+                        ('index', np.int64),
+                        ('height', np.float32)])
+
+
+def _detectone(yy, threshold, polarity, tkill, upperthresh, clean):
+    idx = detectspikes(yy, threshold, polarity, tkill, upperthresh)
+    if clean:
+        idx = cleancontext(idx, yy)
+    return idx, yy[idx]
+
+
+def detect_all(recording,
+               channels: Optional[List[int | str]] = None,
+               threshold: float = 5,
+               polarity: int = 0,
+               tkill: int = 50,
+               upperthresh: Optional[float] = None,
+               clean: bool = True,
+               workers: Optional[int] = None) -> np.ndarray:
+    '''Spike detection on all channels and sweeps of a recording
+
+    Arguments
+    ---------
+
+    recording
+        A *Recording*, or a raw CxT or CxNxT array as from *load*
+
+    channels (optional)
+        The channels to process, by index or name. Default is all.
+
+    threshold (optional)
+        Detection threshold as a multiple of the RMS noise in each
+        channel, which is estimated with *rmsnoise* over all sweeps.
+
+    polarity, tkill (optional)
+        As for *detectspikes*
+
+    upperthresh (optional)
+        As for *detectspikes*, but as a multiple of the RMS noise
+
+    clean (optional)
+        Whether to pass the results through *cleancontext*
+
+    workers (optional)
+        Number of threads to use. Default is the number of CPUs. With
+        only one, everything runs in the calling thread.
+
+    Returns
+    -------
+
+    A structured array of dtype SPIKE_DTYPE, with fields “channel”,
+    “sweep”, “index”, and “height”, sorted by channel, sweep, and
+    index. Heights are in the units of the recording's *data*, or
+    raw if *recording* is an array. For continuous recordings, sweep
+    is always zero.
+
+    Description
+    -----------
+
+    Each channel and sweep is processed independently on a pool of
+    threads. The heavy lifting happens in NumPy and (if available)
+    numba kernels that release the GIL, so this scales with the
+    number of cores without the cost of copying data to other
+    processes. On a single core, threads would only compete for the
+    CPU, so no pool is used.
+
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if isinstance(recording, np.ndarray):
+        names = None
+        getdata = lambda c: recording[c]
+        C = recording.shape[0]
+    else:
+        names = recording.info()["channels"]
+        getdata = lambda c: recording.data(c)[0]
+        C = len(names)
+    if channels is None:
+        channels = range(C)
+    channels = [names.index(c) if type(c)==str else c for c in channels]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = ThreadPoolExecutor(workers) if workers > 1 else None
+    pmap = map if pool is None else pool.map
+    try:
+        data = list(pmap(getdata, channels))
+        noise = list(pmap(lambda dat: rmsnoise(dat.ravel()), data))
+        jobs = []
+        for c, dat, rms in zip(channels, data, noise):
+            sweeps = dat if dat.ndim == 2 else [dat]
+            for n, yy in enumerate(sweeps):
+                uthr = None if upperthresh is None else upperthresh * rms
+                args = (yy, threshold * rms, polarity, tkill, uthr, clean)
+                if pool is None:
+                    jobs.append((c, n, _detectone(*args)))
+                else:
+                    jobs.append((c, n, pool.submit(_detectone, *args)))
+        res = []
+        for c, n, job in jobs:
+            idx, hei = job if pool is None else job.result()
+            part = np.zeros(len(idx), dtype=SPIKE_DTYPE)
+            part['channel'] = c
+            part['sweep'] = n
+            part['index'] = idx
+            part['height'] = hei
+            res.append(part)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if res:
+        return np.concatenate(res)
+    return np.zeros(0, dtype=SPIKE_DTYPE)
+
+
+def extract_snippets(source, idx: np.ndarray[int],
+                     pre: int = 25, post: int = 25,
+                     channels: Optional[List[int | str]] = None,
+                     out=None,
+                     batchsize: int = 65536) -> np.ndarray:
+    '''Waveforms around spikes on one or more channels
+
+    Arguments
+    ---------
+
+    source
+        A *Recording*, the name of a “.escope” file (which is then
+        memory-mapped), or a raw CxT array
+
+    idx
+        Indices of the spikes, e.g., from *detectspikes*. For triggered
+        recordings, indices count scans from the start of the file,
+        i.e., sweep × L + index, where L is the length of a sweep.
+
+    pre, post (optional)
+        Number of samples to extract before and after (and including)
+        each spike
+
+    channels (optional)
+        The channels to extract, by index or name. Default is all.
+
+    out (optional)
+        Either an NxCxW float32 array to fill or the name of a “.npy”
+        file to create as a memory-mapped array of that shape
+
+    batchsize (optional)
+        Number of spikes to read at once
+
+    Returns
+    -------
+
+    An NxCxW float32 array, where N is the number of spikes, C the
+    number of channels, and W = *pre* + *post*. Column j corresponds
+    to an offset of j - *pre* samples from the spike. Samples beyond
+    the ends of the recording are NaN. Data from a *Recording* or file
+    are scaled to the units of *Recording.data*; raw arrays are copied
+    as is.
+
+    Description
+    -----------
+
+    Spikes are processed in order of their index, so that reads from
+    a memory-mapped file proceed sequentially, and in batches, so
+    that memory use is bounded even for millions of snippets when
+    *out* is memory-mapped.
+
+    '''
+
+    from .loader import Recording
+    from .units import Units
+
+    if type(source)==str:
+        source = Recording(source, mmap=True)
+    if isinstance(source, Recording):
+        info = source.info()
+        names = info["channels"]
+        raw = source.rawdata()
+        scale = []
+        for sc in info["scale"]:
+            uni = " ".join(sc.split(" ")[1:]) # drop numeric prefix
+            scale.append(Units(sc).factor_to(uni))
+        scale = np.array(scale)
+    else:
+        names = None
+        raw = source
+        scale = np.ones(len(raw))
+    C = raw.shape[0]
+    raw = raw.reshape(C, -1)
+    T = raw.shape[1]
+    if channels is None:
+        channels = range(C)
+    chans = np.array([names.index(c) if type(c)==str else c
+                      for c in channels], dtype=int)
+    scale = scale[chans].astype(np.float32).reshape(-1, 1, 1)
+
+    idx = np.asarray(idx, dtype=int)
+    N = len(idx)
+    W = pre + post
+    shape = (N, len(chans), W)
+    if type(out)==str:
+        out = np.lib.format.open_memmap(out, mode="w+",
+                                        dtype=np.float32, shape=shape)
+    elif out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape:
+        raise ValueError(f"Output must have shape {shape}")
+
+    order = np.argsort(idx, kind='stable')
+    offsets = np.arange(-pre, post)
+    for b0 in range(0, N, batchsize):
+        which = order[b0:b0+batchsize]
+        rows = idx[which].reshape(-1, 1) + offsets
+        inside = (rows >= 0) & (rows < T)
+        wav = raw[chans.reshape(-1, 1, 1), np.clip(rows, 0, T - 1)]
+        wav = wav.astype(np.float32) * scale
+        wav[:, ~inside] = np.nan
+        out[which] = wav.transpose(1, 0, 2)
+    return out
+
+
+if __name__ == '__main__':
+    import time
+    # Benchmark _droptoonear on synthetic data from a neuron that fires
+    # in long bursts, plus a background of isolated spikes, as in a
+    # multi-hour recording at high firing rate.
+    rng = np.random.default_rng(1)
+    nburst = 2000
+    burst = 1000
+    isi = 20
+    tkill = 50
+    ipk = (np.arange(nburst).reshape(-1, 1) * 100_000
+           + np.arange(burst).reshape(1, -1) * isi).ravel()
+    ipk = np.sort(np.append(ipk, rng.choice(nburst * 100_000, 1_000_000,
+                                            replace=False)))
+    ipk = np.unique(ipk)
+    hei = 5 + 5 * rng.random(len(ipk))
+    funcs = [_droptoonear_py, _droptoonear_np]
+    if havejit:
+        funcs.append(_droptoonear)
+    ref = None
+    for func in funcs:
+        func(ipk[:100], hei[:100].copy(), tkill) # Compile, if needed
+        t0 = time.time()
+        res = func(ipk, hei.copy(), tkill)
+        print(f'{func.__name__}: {time.time() - t0:.3f} s'
+              + f' for {len(ipk)} peaks')
+        if ref is None:
+            ref = res
+        else:
+            assert np.array_equal(res[0], ref[0])
+
+    # Benchmark cleancontext
+    yy = rng.standard_normal(20_000_000)
+    yy[rng.random(len(yy)) < .005] += 10
+    idx = detectspikes(yy, 5)
+    t0 = time.time()
+    ref = _cleancontext_py(idx, yy, [range(-25, -12), range(12, 25)],
+                           [range(-25, -4), range(4, 25)], 0.50, 0.90)
+    print(f'_cleancontext_py: {time.time() - t0:.3f} s for {len(idx)} spikes')
+    t0 = time.time()
+    res = cleancontext(idx, yy)
+    print(f'cleancontext: {time.time() - t0:.3f} s for {len(idx)} spikes')
+    assert np.array_equal(res, ref)
+
+    # Benchmark detect_all against a serial loop
+    data = rng.standard_normal((8, 5_000_000)).astype(np.float32)
+    data[rng.random(data.shape) < .001] += 10
+    detect_all(data[:, :10000]) # Compile, if needed
+    t0 = time.time()
+    ref = [cleancontext(detectspikes(dat, 5 * rmsnoise(dat)), dat)
+           for dat in data]
+    print(f'serial: {time.time() - t0:.3f} s for {data.shape} samples')
+    t0 = time.time()
+    res = detect_all(data)
+    print(f'detect_all: {time.time() - t0:.3f} s for {len(res)} spikes')
+    for workers in [1, 4]:
+        t0 = time.time()
+        res1 = detect_all(data, workers=workers)
+        print(f'detect_all (workers={workers}): {time.time() - t0:.3f} s')
+        assert np.array_equal(res1, res)
+    for c in range(len(data)):
+        assert np.array_equal(res['index'][res['channel']==c], ref[c])
+
+    # SpikeDetector must reproduce detectspikes exactly, however the
+    # data are split into blocks. Include NaNs and ties, and single-
+    # sample blocks.
+    ntrial = 0
+    for trial in range(400):
+        T = int(rng.integers(1, 3000))
+        yy = rng.standard_normal(T)
+        yy[rng.random(T) < .01] += 8
+        yy[rng.random(T) < .01] -= 8
+        if trial % 5 == 0:
+            yy[rng.random(T) < .01] = np.nan
+        if trial % 7 == 0:
+            yy = np.round(2 * yy) # Ties
+        polarity = [-1, 0, 1][trial % 3]
+        tkill = [None, 5, 50, 200][trial % 4]
+        upperthresh = [None, 7.0][(trial // 4) % 2]
+        ref = detectspikes(yy, 3, polarity, tkill, upperthresh)
+        det = SpikeDetector(3, polarity, tkill, upperthresh)
+        if trial % 10 == 0:
+            cuts = np.arange(T)
+        else:
+            cuts = np.sort(rng.integers(0, T, int(rng.integers(0, 40))))
+        res = []
+        prev = 0
+        for cut in list(cuts) + [T]:
+            res.append(det.feed(yy[prev:cut]))
+            prev = cut
+        res.append(det.finish())
+        assert np.array_equal(np.concatenate(res), ref), trial
+        ntrial += 1
+    print(f'SpikeDetector matches detectspikes on {ntrial} split traces')
+
+    # The correction factor must match the median of the Monte Carlo
+    # estimate, even for small chunks and few of them
+    for chunksize, nchunks in [(10, 50), (3, 20), (300, 1000)]:
+        nrun = min(max(2_000_000 // (chunksize * nchunks), 100), 2000)
+        mc = np.median([_estimatemuckfactor(chunksize, nchunks)
+                        for _ in range(nrun)])
+        cf = _muckfactor(chunksize, nchunks)
+        print(f'_muckfactor({chunksize}, {nchunks}): {cf:.4f};'
+              + f' Monte Carlo: {mc:.4f}')
+        assert abs(mc / cf - 1) < .01
+    try:
+        rmsnoise(yy, 1)
+        assert False, 'rmsnoise accepted chunksize 1'
+    except ValueError:
+        pass
+
+    # Until it has seen more than nchunks chunks, RunningNoise must
+    # equal rmsnoise on the concatenated data, however these are split.
+    for trial in range(50):
+        chunksize = int(rng.integers(10, 500))
+        T = int(rng.integers(chunksize, 200_000))
+        yy = 2 * rng.standard_normal(T)
+        yy[rng.random(T) < .002] += 15
+        noise = RunningNoise(chunksize, nchunks=T // chunksize + 1)
+        pos = 0
+        while pos < T:
+            n = int(rng.integers(1, 5 * chunksize))
+            est = noise.feed(yy[pos:pos+n])
+            pos += n
+        ref = rmsnoise(yy, chunksize)
+        assert est == ref, (trial, est, ref)
+    print('RunningNoise matches rmsnoise on 50 split traces')
+
+    # extract_snippets must return the same snippets as Recording.data,
+    # whether the recording is in memory, memory-mapped, or opened by
+    # name and written to a memory-mapped “.npy” file in batches.
+    import json
+    import tempfile
+    from .loader import Recording
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, 'snip')
+        T = 200_000
+        names = ['ai0', 'ai1', 'ai2', 'ai3']
+        rng.standard_normal((T, 4)).astype(np.float32).tofile(fn + '.dat')
+        with open(fn + '.escope', 'w') as fd:
+            json.dump({'version': 'escope-3.3', 'channels': names,
+                       'scale': ['1 V', '100 mV', '1 V', '2 mA'],
+                       'rate_Hz': 10000, 'rundate': '20240101-120000',
+                       'config': {'trig': {'enable': False},
+                                  'capt_enable': True}}, fd)
+        rec = Recording(fn + '.escope')
+        recm = Recording(fn + '.escope', mmap=True)
+        idx = rng.integers(-30, T + 30, 5000)
+        idx[:4] = [0, 9, T - 20, T - 1]
+        pre, post = 10, 20
+        res = extract_snippets(rec, idx, pre, post)
+        ref = np.full(res.shape, np.nan, dtype=np.float32)
+        for c in range(4):
+            y = rec.data(c)[0]
+            for j in range(pre + post):
+                ii = idx + j - pre
+                ok = (ii >= 0) & (ii < T)
+                ref[ok, c, j] = y[ii[ok]]
+        assert np.allclose(res, ref, rtol=1e-6, atol=0, equal_nan=True)
+        assert np.array_equal(extract_snippets(recm, idx, pre, post), res,
+                              equal_nan=True)
+        out = extract_snippets(fn + '.escope', idx, pre, post,
+                               out=os.path.join(tmp, 'snip.npy'),
+                               batchsize=1000)
+        assert np.array_equal(out, res, equal_nan=True)
+        sub = extract_snippets(recm, idx, pre, post, channels=['ai1', 3])
+        assert np.array_equal(sub, res[:, [1, 3]], equal_nan=True)
+        del rec, recm, out
+    print(f'extract_snippets matches Recording.data on {len(idx)} spikes')
@@ -16,6 +16,7 @@
 
 
 import re
+import functools
 import numpy as np
 from typing import Optional
 
@@ -129,6 +130,14 @@ def _fracdecode(s):
     return mul, code
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile(s):
+    # Parsed form of a unit string: multiplier and dimension vector.
+    # The latter is a tuple, so that cached results cannot be modified.
+    mul, code = _fracdecode(s)
+    return mul, tuple(code)
+
+
 _numre = re.compile('^[-0-9+.]')
 def _factordecode(fac):
     if _numre.search(fac):
@@ -283,7 +292,7 @@ class Units:
             unit = value
             value = 1
         self.value = value
-        self.mul, self.code = _fracdecode(unit)
+        self.mul, self.code = _compile(unit)
 
         
     def definition(self, withoutvalue=False):
@@ -327,7 +336,38 @@ class Units:
         return ' '.join(ss)
 
                 
-    def asunits(self, newunit: str, warn=False) -> float | np.ndarray:
+    def factor_to(self, newunit: str, warn=False) -> float:
+        '''Conversion factor to different units
+
+        Parameters
+        ----------
+
+        newunit
+            string representation of unit to convert to
+
+        Returns
+        -------
+
+        The factor by which the stored *value* must be multiplied to
+        express it in the new units. This lets callers fold a
+        conversion into arithmetic they are doing anyway.
+
+        Notes
+        ------
+
+        Incompatible units are handled as in *asunits*.
+        '''
+        newmul, newcode = _compile(newunit)
+        if self.code != newcode:
+            if warn:
+                print(f'WARNING: Units {newunit} do not match {self.definition(True)}')
+            else:
+                raise ValueError(f'Units {newunit} do not match {self.definition(True)}')
+        return self.mul / newmul
+
+    def asunits(self, newunit: str, warn=False,
+                out: Optional[np.ndarray] = None,
+                copy: bool = True) -> float | np.ndarray:
         '''Convert to different units
 
         Parameters
@@ -336,12 +376,20 @@ class Units:
         newunit
             string representation of unit to convert to
 
+        out (optional)
+            array into which to write the result
+
+        copy (optional)
+            if False, an array *value* of floating point type is
+            converted in place
+
         Returns
         -------
 
         The conversion result. The shape and data type of the result
         will match the original *value* passed into the *Units*
-        constructor.
+        constructor, except that integer arrays are converted to
+        float. If *out* is given, it is returned.
 
         Notes
         ------
@@ -353,11 +401,41 @@ class Units:
         See the class documentation for unit syntax and note that
         addition or subtraction is not supported.
         '''
-        newmul, newcode = _fracdecode(newunit)
-        if np.any(self.code != newcode):
-            if warn:
-                print(f'WARNING: Units {newunit} do not match {self.definition(True)}')
-            else:
-                raise ValueError(f'Units {newunit} do not match {self.definition(True)}')
-        return self.value * self.mul / newmul
-
+        fac = self.factor_to(newunit, warn)
+        val = self.value
+        if not isinstance(val, np.ndarray):
+            if out is not None:
+                out[...] = val * fac
+                return out
+            return val * fac
+        if val.dtype.kind in 'fc':
+            # Multiply by a scalar of the array's own type, so that
+            # float32 data stay float32, in a single pass
+            fac = val.dtype.type(fac)
+            if out is None and not copy:
+                out = val
+        return np.multiply(val, fac, out=out)
+
+if __name__ == '__main__':
+    import time
+    # Time repeated conversions with the same few unit strings, as
+    # done by the loader and the channel configuration dialogs,
+    # against parsing the strings every time.
+    scales = ['1 V', '100 mV', '10 mV', '1 nA', '2.5 uA', 'kg m / s^2']
+    targets = ['mV', 'mV', 'uV', 'pA', 'nA', 'N']
+    N = 10000
+    t0 = time.time()
+    for k in range(N):
+        for sc, tg in zip(scales, targets):
+            mul, code = _fracdecode(sc)
+            newmul, newcode = _fracdecode(tg)
+            assert np.all(code == newcode)
+            mul / newmul
+    dt = time.time() - t0
+    print(f'parsed: {1e6*dt/N/len(scales):.2f} us per conversion')
+    t0 = time.time()
+    for k in range(N):
+        for sc, tg in zip(scales, targets):
+            Units(sc).asunits(tg)
+    dt = time.time() - t0
+    print(f'cached: {1e6*dt/N/len(scales):.2f} us per conversion')
@@ -0,0 +1,80 @@
+# startuptime.py - How long EScope takes to import and to show its window
+#
+# Run as "python test/startuptime.py" from the top of the source tree.
+# Uses "python -X importtime" to find where import time goes, and
+# then times the construction of the main window. Set
+# QT_QPA_PLATFORM=offscreen to run without a display.
+
+import subprocess
+import sys
+import os
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+env = dict(os.environ)
+env["PYTHONPATH"] = src + os.pathsep + env.get("PYTHONPATH", "")
+
+WATCH = ["escope.escope", "escope", "numba", "pyqtgraph", "matplotlib",
+         "escope.escopelib.esparkwin", "escope.escopelib.esnidaq",
+         "escope.escopelib.espicodaq", "nidaqmx", "picodaq"]
+
+
+def importtimes(module, runs=5):
+    """Cumulative import time (ms) of modules in WATCH, best of RUNS"""
+    best = {}
+    for r in range(runs):
+        res = subprocess.run([sys.executable, "-X", "importtime",
+                              "-c", f"import {module}"],
+                             env=env, capture_output=True, text=True)
+        for line in res.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            bits = line[12:].split("|")
+            try:
+                cum = int(bits[1]) / 1000
+            except ValueError:
+                continue # The header line
+            name = bits[2].strip()
+            if name in WATCH:
+                best[name] = min(cum, best.get(name, cum))
+    return best
+
+
+WINDOW = """
+import time
+t0 = time.time()
+from PyQt5.QtWidgets import QApplication
+import escope.escope as es
+app = QApplication([])
+cfg = es.esconfig.basicconfig()
+mw = es.MainWin(cfg)
+mw.show()
+app.processEvents()
+t1 = time.time()
+mw.click_stim()
+app.processEvents()
+t2 = time.time()
+print(f"{1e3*(t1-t0):.0f} {1e3*(t2-t1):.0f}")
+"""
+
+def windowtimes(runs=3):
+    """Time (ms) to show the main window, and then the stimulus window"""
+    best = None
+    for r in range(runs):
+        res = subprocess.run([sys.executable, "-c", WINDOW],
+                             env=env, capture_output=True, text=True)
+        tt = [float(x) for x in res.stdout.splitlines()[-1].split()]
+        best = tt if best is None else [min(a, b) for a, b in zip(best, tt)]
+    return best
+
+
+if __name__ == "__main__":
+    tt = importtimes("escope.escope")
+    print("Cumulative import time of “escope.escope” (ms):")
+    for name in WATCH:
+        if name in tt:
+            print(f"  {name:30s} {tt[name]:7.1f}")
+        else:
+            print(f"  {name:30s}     (not loaded)")
+    main, stim = windowtimes()
+    print(f"Main window shown after {main:.0f} ms")
+    print(f"Stimulus window shown {stim:.0f} ms later")